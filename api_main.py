@@ -1,8 +1,8 @@
-from human_interaction import InteractionAPI
+from session_registry import get_session
 
+import logging
 import os
 import pandas as pd
-from predictors import Predictors
 csv_file_path = os.path.join(os.getcwd(), "api21less.csv")
 cols = ["positive exp Count", "negative exp Count", "Trust", "Distrust", "Uncertainty",  "Kinship"]
 if not os.path.isfile(csv_file_path):
@@ -12,11 +12,13 @@ if not os.path.isfile(csv_file_path):
 else:
     data = pd.read_csv(csv_file_path)
 
+# Show every step of the trust calculation
+logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
 
 
 for i in range(1):
-    interaction_object = InteractionAPI(user="user19")
+    interaction_object = get_session("user19")
 
     #CALL WHEN MISSION STARTS BEFORE ANY SUBTASKS, FOR TESTING
     interaction_object.update_exp_response_time(response_time=2)
@@ -48,8 +50,8 @@ for i in range(1):
     interaction_probability = interaction_object.fetch_probability_value()
     print(interaction_probability)
 
-    p_count, n_count, kinship = Predictors("user19").get_details()
-    t, d, u = Predictors("user19").fetch_trust_values()
+    p_count, n_count, kinship = interaction_object.user_predictor.get_details()
+    t, d, u = interaction_object.get_trust_values()
     data = pd.concat([data, pd.DataFrame([[p_count, n_count, t, d, u, kinship]], columns=cols)])
     
     #AFTER aall subtasks
@@ -0,0 +1,184 @@
+"""
+Benchmarks for the hot paths of the trust pipeline
+    python benchmark.py run --output results.json
+    python benchmark.py compare baseline.json results.json
+Every benchmark runs in a temporary config folder, results are per call timings in microseconds
+"""
+import argparse
+import csv
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from config_manager import ConfigManger
+from human_interaction import HISTORY_COLUMNS, InteractionAPI
+from predictors import Predictors, SubtaskStatistics
+from storage import FileStorage, MemoryStorage
+from trust import Trust, closed_form_certainty
+
+CERTAINTY_COUNTS = [(1, 1), (12, 52), (100, 100), (1000, 3000), (10000, 10000), (0, 500)]
+HISTORY_LENGTHS = [10, 1000, 100000]
+STATUS_LENGTHS = [10, 1000, 100000]
+
+
+def measure(function, min_time: float = 0.2, repeat: int = 5):
+    """
+    Times function, calling it in batches until each batch lasts at least min_time / repeat seconds
+    @return: dict of median, mean and min time per call in microseconds and the number of calls
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return {"median_us": statistics.median(timings) * 1e6, "mean_us": statistics.mean(timings) * 1e6,
+            "min_us": min(timings) * 1e6, "calls": number * repeat}
+
+
+def write_history(storage: FileStorage, user: str, rows: int):
+    """
+    Writes a synthetic history of the given length for the user
+    """
+    storage.create_history(user, HISTORY_COLUMNS)
+    row = ["", 1, 1, 0.1, 0.1, 0.8, None, 0.5, 0.5, 0.5, 10, 10, 1, [1.0, 2.0], 1, 0.5, 0]
+    with open(storage.history_path(user), "a", newline="") as outfile:
+        csv.writer(outfile).writerows([row] * rows)
+
+
+def benchmark_certainty(results: dict, args):
+    for p_count, n_count in CERTAINTY_COUNTS:
+        results["certainty[%d,%d]" % (p_count, n_count)] = measure(
+            lambda: closed_form_certainty(p_count, n_count), args.min_time)
+
+
+def benchmark_trust_vector(results: dict, args):
+    for kinship in (None, 0.6):
+        trust = Trust(12, 52, kinship)
+        results["update_trust_vector[kinship=%s]" % kinship] = measure(trust.update_trust_vector, args.min_time)
+
+
+def benchmark_calculate_trust(results: dict, args):
+    for length in HISTORY_LENGTHS:
+        with tempfile.TemporaryDirectory(prefix="trust_benchmark") as config_dir:
+            storage = FileStorage(config_dir)
+            user = "history%d" % length
+            write_history(storage, user, length)
+            # Only the subtask is timed, the session is opened once as a controller would
+            session = InteractionAPI(user, user_storage=storage)
+            results["calculate_trust[history=%d]" % length] = measure(
+                lambda: session.calculate_trust(2, 10, [1.0, 3.0], 1, 11), args.min_time)
+            session.flush()
+
+
+def benchmark_config(results: dict, args):
+    with tempfile.TemporaryDirectory(prefix="trust_benchmark") as config_dir:
+        storage = FileStorage(config_dir)
+        ConfigManger("config", user_storage=storage).fetch_config()
+        results["fetch_config"] = measure(lambda: ConfigManger("config", user_storage=storage).fetch_config(),
+                                          args.min_time)
+        manager = ConfigManger("config", user_storage=storage)
+        manager.fetch_config()
+        results["update_config"] = measure(lambda: manager.update_config({"trust": 0.5}), args.min_time)
+        manager.flush()
+
+
+def benchmark_reliability(results: dict, args):
+    # Reliability reads nothing from the storage, the configuration is kept in memory
+    predictor = Predictors("reliability", user_storage=MemoryStorage())
+    for length in STATUS_LENGTHS:
+        status = [i % 3 and 1 or 0 for i in range(length)]
+        results["calculate_reliability[status=%d]" % length] = measure(
+            lambda: predictor.calculate_reliability(status), args.min_time)
+        subtask_statistics = SubtaskStatistics()
+        for value in status:
+            subtask_statistics.add_status(value)
+
+        def running_reliability():
+            subtask_statistics.add_status(1)
+            return predictor.calculate_running_reliability(subtask_statistics)
+        results["calculate_running_reliability[status=%d]" % length] = measure(running_reliability, args.min_time)
+
+
+BENCHMARKS = {
+    "certainty": benchmark_certainty,
+    "trust_vector": benchmark_trust_vector,
+    "calculate_trust": benchmark_calculate_trust,
+    "config": benchmark_config,
+    "reliability": benchmark_reliability,
+}
+
+
+def run(args):
+    results = {}
+    selected = args.only or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name](results, args)
+    report = {"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "results": results}
+    with open(args.output, "w") as outfile:
+        json.dump(report, outfile, indent=4)
+    for name, result in results.items():
+        print("%-45s %12.2f us" % (name, result["median_us"]))
+    print("Results saved at", args.output)
+
+
+def compare(args):
+    """
+    Compares median timings of two result files
+    @return: exit status, 1 if any benchmark is slower than the threshold allows
+    """
+    with open(args.baseline) as infile:
+        baseline = json.load(infile)["results"]
+    with open(args.current) as infile:
+        current = json.load(infile)["results"]
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        ratio = current[name]["median_us"] / baseline[name]["median_us"]
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = "faster"
+        print("%-45s %12.2f %12.2f %7.2fx %s" % (name, baseline[name]["median_us"], current[name]["median_us"],
+                                                  ratio, flag))
+    for name in sorted(set(baseline) ^ set(current)):
+        print("%-45s only in %s" % (name, "baseline" if name in baseline else "current"))
+    print(regressions, "regressions over", "%d%%" % (args.threshold * 100))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trust pipeline hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and save the results as json")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="benchmarks to run, all if not given")
+    run_parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent timing each benchmark")
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Precomputed certainty values for experience counts 0..N
+The table is saved as a numpy file and opened memory mapped,
+so every robot process on a machine shares the same pages instead of its own copy
+enable() opens the table and registers it, so every Trust of the process reads from it
+"""
+import argparse
+import os
+import numpy as np
+from trust import calculate_certainty_batch, use_certainty_table
+DIR_NAME = os.path.dirname(__file__)
+DEFAULT_TABLE_PATH = os.path.join(DIR_NAME, "config", "certainty_table.npy")
+DEFAULT_MAX_COUNT = 1000
+
+
+class CertaintyTable(object):
+
+    def __init__(self, values):
+        """
+        @param values: square array, values[p_count, n_count] is the certainty of that pair
+        """
+        self.values = values
+        self.size = values.shape[0]
+
+    @classmethod
+    def build(cls, max_count: int = DEFAULT_MAX_COUNT):
+        """
+        Computes certainty for every pair of counts from 0 to max_count
+        The pair (0, 0) has no certainty and is stored as NaN
+        @return: CertaintyTable
+        """
+        counts = np.arange(max_count + 1, dtype=float)
+        return cls(calculate_certainty_batch(counts[:, None], counts[None, :]))
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_TABLE_PATH):
+        """
+        Opens a saved table memory mapped and read only
+        @return: CertaintyTable
+        """
+        return cls(np.load(path, mmap_mode="r"))
+
+    @classmethod
+    def load_or_build(cls, path: str = DEFAULT_TABLE_PATH, max_count: int = DEFAULT_MAX_COUNT):
+        """
+        Opens the table at path, building and saving it first if it does not exist yet
+        @return: CertaintyTable
+        """
+        if not os.path.isfile(path):
+            cls.build(max_count).save(path)
+        return cls.load(path)
+
+    def save(self, path: str = DEFAULT_TABLE_PATH):
+        """
+        Writes the table next to its final location and renames it into place,
+        so processes opening it never see a partially written file
+        """
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, "wb") as outfile:
+            np.save(outfile, np.ascontiguousarray(self.values))
+        os.replace(temp_path, path)
+
+    def lookup(self, p_count, n_count):
+        """
+        @return: certainty for the pair of counts, None if the pair is outside the table
+        """
+        if 0 <= p_count < self.size and 0 <= n_count < self.size \
+                and p_count == int(p_count) and n_count == int(n_count):
+            certainty = float(self.values[int(p_count), int(n_count)])
+            if certainty == certainty:
+                return certainty
+        return None
+
+
+def enable(path: str = DEFAULT_TABLE_PATH, max_count: int = DEFAULT_MAX_COUNT):
+    """
+    Opens the table at path, building it if needed, and registers it for every Trust in this process
+    @return: CertaintyTable
+    """
+    table = CertaintyTable.load_or_build(path, max_count)
+    use_certainty_table(table)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the shared certainty lookup table")
+    parser.add_argument("--max-count", type=int, default=DEFAULT_MAX_COUNT,
+                        help="largest experience count covered by the table")
+    parser.add_argument("--path", default=DEFAULT_TABLE_PATH, help="where to save the table")
+    args = parser.parse_args()
+    CertaintyTable.build(args.max_count).save(args.path)
+    print("Certainty table for counts 0 to", args.max_count, "saved at", args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+Binary columnar layout of the subtask history, for analytics over long histories
+The history of a user is a folder <user>.columns next to its yaml configuration:
+    meta.json       column names, column types and number of rows
+    <i>.data        values of column i, fixed width little endian int64 or float64
+    <i>.lengths     for variable length columns, length of the value of each row, -1 for None
+Variable length columns, the task name and the list of actual response times, keep their values
+one after the other in <i>.data and are split again with the lengths
+Rows are appended at the end of every file and meta.json is replaced last, so a crash in the middle
+of an append leaves the previous rows readable and the torn tail is cut at the next append
+Readers map the files with numpy.memmap, scans do not copy or parse the history
+    python columnar_history.py import --config-dir config
+    python columnar_history.py trajectory user19
+"""
+import argparse
+import json
+import math
+import os
+from contextlib import ExitStack
+from storage import DEFAULT_CONFIG_DIR, FileStorage, atomic_write, parse_value
+
+COLUMNS_SUFFIX = ".columns"
+# Type of each history column, columns not listed are kept as text
+COLUMN_TYPES = {
+    "Task": "text",
+    "positive exp Count": "int",
+    "negative exp Count": "int",
+    "Trust": "float",
+    "Distrust": "float",
+    "Uncertainty": "float",
+    "Kinship": "float",
+    "Competency": "float",
+    "Conformance": "float",
+    "reliability": "float",
+    "actual time": "float",
+    "expected time": "float",
+    "goalstatus": "int",
+    "actual response time": "floats",
+    "role": "int",
+    "predictor_value": "float",
+    # Text so the rows of histories written before the column was added can stay empty
+    "mission": "text",
+}
+DTYPES = {"int": "<i8", "float": "<f8", "text": "u1", "floats": "<f8"}
+VARIABLE_TYPES = ("text", "floats")
+
+
+def _encode_fixed(kind: str, values: list):
+    """
+    @return: array of the values, None is kept as NaN in float columns
+    """
+    import numpy as np
+    if kind == "float":
+        return np.array([math.nan if value is None else value for value in values], dtype=DTYPES[kind])
+    if any(value is None for value in values):
+        raise ValueError("Integer history columns cannot hold empty values")
+    return np.array(values, dtype=DTYPES[kind])
+
+
+def _encode_variable(kind: str, values: list):
+    """
+    @return: array of the lengths, -1 for None, and array of the concatenated values
+    """
+    import numpy as np
+    lengths, parts = [], []
+    for value in values:
+        if value is None:
+            lengths.append(-1)
+            continue
+        if kind == "text":
+            value = str(value).encode("utf-8")
+        else:
+            value = [float(item) for item in value]
+        lengths.append(len(value))
+        parts.append(value)
+    if kind == "text":
+        data = np.frombuffer(b"".join(parts), dtype=DTYPES[kind])
+    else:
+        data = np.array([item for part in parts for item in part], dtype=DTYPES[kind])
+    return np.array(lengths, dtype="<i8"), data
+
+
+class ColumnarHistory(object):
+    """
+    Read only view of the columnar history of one user, columns are memory mapped on first use
+    """
+
+    def __init__(self, path: str):
+        """
+        @param path: <user>.columns folder
+        """
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as infile:
+            self.meta = json.load(infile)
+        self.columns = self.meta["columns"]
+        self.types = self.meta["types"]
+        self.rows = self.meta["rows"]
+        self.mapped = {}
+
+    def __len__(self):
+        return self.rows
+
+    def _map(self, name: str, dtype: str, count: int):
+        import numpy as np
+        if name not in self.mapped:
+            if count == 0:
+                self.mapped[name] = np.empty(0, dtype=dtype)
+            else:
+                self.mapped[name] = np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r",
+                                              shape=(count,))
+        return self.mapped[name]
+
+    def column(self, column: str):
+        """
+        @return: array of a fixed width column, NaN where a float value is empty
+        """
+        index = self.columns.index(column)
+        kind = self.types[index]
+        if kind in VARIABLE_TYPES:
+            raise ValueError(column + " has variable length values, use lengths and values")
+        return self._map("%d.data" % index, DTYPES[kind], self.rows)
+
+    def lengths(self, column: str):
+        """
+        @return: array of the length of the value of each row of a variable length column, -1 for None
+        """
+        index = self.columns.index(column)
+        return self._map("%d.lengths" % index, "<i8", self.rows)
+
+    def values(self, column: str):
+        """
+        @return: concatenated values of a variable length column, bytes of utf-8 text for text columns
+        """
+        index = self.columns.index(column)
+        return self._map("%d.data" % index, DTYPES[self.types[index]], self.meta["sizes"][str(index)])
+
+    def offsets(self, column: str):
+        """
+        @return: array of rows + 1 positions, values of row i are values[offsets[i]:offsets[i + 1]]
+        """
+        import numpy as np
+        offsets = np.zeros(self.rows + 1, dtype="<i8")
+        np.cumsum(np.maximum(self.lengths(column), 0), out=offsets[1:])
+        return offsets
+
+    def iter_rows(self, chunksize: int = 10000):
+        """
+        Streams the rows with the same values a csv history would give
+        @return: iterator of dict, column name to value
+        """
+        offsets = {column: self.offsets(column) for column, kind in zip(self.columns, self.types)
+                   if kind in VARIABLE_TYPES}
+        for start in range(0, self.rows, chunksize):
+            stop = min(self.rows, start + chunksize)
+            chunk = []
+            for column, kind in zip(self.columns, self.types):
+                if kind == "int":
+                    chunk.append(self.column(column)[start:stop].tolist())
+                elif kind == "float":
+                    chunk.append([None if value != value else value
+                                  for value in self.column(column)[start:stop].tolist()])
+                else:
+                    chunk.append(self._variable_slice(column, kind, offsets[column], start, stop))
+            for row in zip(*chunk):
+                yield dict(zip(self.columns, row))
+
+    def _variable_slice(self, column: str, kind: str, offsets, start: int, stop: int):
+        lengths = self.lengths(column)[start:stop].tolist()
+        data = self.values(column)[offsets[start]:offsets[stop]]
+        data = data.tobytes() if kind == "text" else data.tolist()
+        base, result = offsets[start], []
+        for length, offset in zip(lengths, offsets[start:stop].tolist()):
+            if length < 0:
+                result.append(None)
+            elif kind == "text":
+                # Text goes through parse_value like a csv cell does
+                result.append(parse_value(data[offset - base:offset - base + length].decode("utf-8")))
+            else:
+                result.append(data[offset - base:offset - base + length])
+        return result
+
+    def trust_trajectory(self):
+        """
+        @return: dict of "trust", "distrust", "uncertainty" and "kinship" to an array with one value per subtask
+        """
+        return {"trust": self.column("Trust"), "distrust": self.column("Distrust"),
+                "uncertainty": self.column("Uncertainty"), "kinship": self.column("Kinship")}
+
+    def distribution(self, column: str, bins: int = 10, value_range: tuple = (0, 1)):
+        """
+        Histogram and summary of a float column, empty values are left out
+        @return: dict of "counts", "edges", "count", "mean", "std" and "percentiles" at 5, 25, 50, 75 and 95
+        """
+        import numpy as np
+        values = self.column(column)
+        values = values[~np.isnan(values)]
+        counts, edges = np.histogram(values, bins=bins, range=value_range)
+        summary = {"counts": counts, "edges": edges, "count": int(values.size)}
+        if values.size:
+            summary.update({"mean": float(values.mean()), "std": float(values.std()),
+                            "percentiles": np.percentile(values, [5, 25, 50, 75, 95])})
+        return summary
+
+    def conformance_distribution(self, bins: int = 10):
+        return self.distribution("Conformance", bins)
+
+
+class ColumnarStorage(FileStorage):
+    """
+    Yaml configurations as FileStorage, histories in the columnar layout
+    """
+
+    def columns_path(self, user: str):
+        return os.path.join(self.config_dir, user + COLUMNS_SUFFIX)
+
+    def sync(self, user: str):
+        if not os.path.isdir(self.columns_path(user)):
+            return
+        for name in os.listdir(self.columns_path(user)):
+            with open(os.path.join(self.columns_path(user), name), "rb") as infile:
+                os.fsync(infile.fileno())
+
+    def _meta_path(self, user: str):
+        return os.path.join(self.columns_path(user), "meta.json")
+
+    def _load_meta(self, user: str):
+        if not os.path.isfile(self._meta_path(user)):
+            return None
+        with open(self._meta_path(user)) as infile:
+            return json.load(infile)
+
+    def create_history(self, user: str, columns: list):
+        if os.path.isfile(self._meta_path(user)):
+            self.upgrade_history(user, columns)
+            return
+        os.makedirs(self.columns_path(user), exist_ok=True)
+        types = [COLUMN_TYPES.get(column, "text") for column in columns]
+        sizes = {str(index): 0 for index, kind in enumerate(types) if kind in VARIABLE_TYPES}
+        for index, kind in enumerate(types):
+            names = ["%d.data" % index] + (["%d.lengths" % index] if kind in VARIABLE_TYPES else [])
+            for name in names:
+                open(os.path.join(self.columns_path(user), name), "wb").close()
+        atomic_write(self._meta_path(user), json.dumps({"columns": list(columns), "types": types,
+                                                        "rows": 0, "sizes": sizes}))
+
+    def upgrade_history(self, user: str, columns: list):
+        """
+        Adds the columns missing from a history written by an older version, empty in the rows it holds
+        """
+        import numpy as np
+        meta = self._load_meta(user)
+        added = [column for column in columns if column not in meta["columns"]]
+        if not added:
+            return
+        with self.lock(user):
+            meta = self._load_meta(user)
+            for column in columns:
+                if column in meta["columns"]:
+                    continue
+                index, kind = len(meta["columns"]), COLUMN_TYPES.get(column, "text")
+                if kind not in VARIABLE_TYPES and kind != "float":
+                    raise ValueError("Integer history column %s cannot be added to an existing history" % column)
+                folder = self.columns_path(user)
+                if kind in VARIABLE_TYPES:
+                    open(os.path.join(folder, "%d.data" % index), "wb").close()
+                    with open(os.path.join(folder, "%d.lengths" % index), "wb") as outfile:
+                        outfile.write(np.full(meta["rows"], -1, dtype="<i8").tobytes())
+                    meta["sizes"][str(index)] = 0
+                else:
+                    with open(os.path.join(folder, "%d.data" % index), "wb") as outfile:
+                        outfile.write(np.full(meta["rows"], math.nan, dtype=DTYPES[kind]).tobytes())
+                meta["columns"].append(column)
+                meta["types"].append(kind)
+            atomic_write(self._meta_path(user), json.dumps(meta))
+
+    def append_history(self, user: str, columns: list, rows: list):
+        if not os.path.isfile(self._meta_path(user)):
+            self.create_history(user, columns)
+        if not rows:
+            return
+        meta = self._load_meta(user)
+        by_name = [list(column) for column in zip(*rows)]
+        by_name = dict(zip(columns, by_name))
+        empty = [None] * len(rows)
+        folder = self.columns_path(user)
+        with ExitStack() as stack:
+            for index, (column, kind) in enumerate(zip(meta["columns"], meta["types"])):
+                values = by_name.get(column, empty)
+                if kind in VARIABLE_TYPES:
+                    lengths, data = _encode_variable(kind, values)
+                    parts = [("%d.lengths" % index, lengths, meta["rows"] * 8),
+                             ("%d.data" % index, data, meta["sizes"][str(index)] * data.itemsize)]
+                    meta["sizes"][str(index)] += int(data.size)
+                else:
+                    data = _encode_fixed(kind, values)
+                    parts = [("%d.data" % index, data, meta["rows"] * data.itemsize)]
+                for name, array, size in parts:
+                    outfile = stack.enter_context(open(os.path.join(folder, name), "r+b"))
+                    # Cut what a crashed append left after the last complete row
+                    outfile.truncate(size)
+                    outfile.seek(size)
+                    outfile.write(array.tobytes())
+        meta["rows"] += len(rows)
+        atomic_write(self._meta_path(user), json.dumps(meta))
+
+    def open_history(self, user: str):
+        """
+        @return: ColumnarHistory of the user, None if the user has no history
+        """
+        if not os.path.isfile(self._meta_path(user)):
+            return None
+        return ColumnarHistory(self.columns_path(user))
+
+    def iter_history(self, user: str):
+        history = self.open_history(user)
+        if history is None:
+            return iter(())
+        return history.iter_rows()
+
+    def import_csv(self, user: str, source: FileStorage = None, batch_size: int = 10000):
+        """
+        Appends the csv rows the columnar history of the user does not hold yet, so importing again
+        adds nothing and an interrupted import continues where it stopped
+        @param source: storage holding the csv history, the same config folder if not given
+        @return: number of rows imported
+        """
+        source = source or FileStorage(self.config_dir)
+        history = self.open_history(user)
+        imported = len(history) if history is not None else 0
+        columns, rows, count = None, [], 0
+        for i, row in enumerate(source.iter_history(user)):
+            if i < imported:
+                continue
+            columns = columns or list(row.keys())
+            rows.append([row.get(column) for column in columns])
+            if len(rows) >= batch_size:
+                self.append_history(user, columns, rows)
+                count, rows = count + len(rows), []
+        if rows:
+            self.append_history(user, columns, rows)
+            count += len(rows)
+        return count
+
+    def export_csv(self, user: str, target: FileStorage = None, batch_size: int = 10000):
+        """
+        Writes the columnar history of the user in the csv layout, integers come back as integers
+        and every other number as a float
+        @param target: storage receiving the csv history, the same config folder if not given
+        @return: number of rows exported
+        """
+        target = target or FileStorage(self.config_dir)
+        history = self.open_history(user)
+        if history is None:
+            return 0
+        target.create_history(user, history.columns)
+        rows, count = [], 0
+        for row in history.iter_rows(batch_size):
+            rows.append([row[column] for column in history.columns])
+            if len(rows) >= batch_size:
+                target.append_history(user, history.columns, rows)
+                count, rows = count + len(rows), []
+        if rows:
+            target.append_history(user, history.columns, rows)
+            count += len(rows)
+        return count
+
+
+def trust_trajectories(config_dir: str = DEFAULT_CONFIG_DIR, users: list = None):
+    """
+    @param users: users to read, every user with a columnar history if not given
+    @return: dict of user to the trust trajectory of ColumnarHistory
+    """
+    columnar = ColumnarStorage(config_dir)
+    users = users if users is not None else columnar.list_users()
+    histories = ((user, columnar.open_history(user)) for user in users)
+    return {user: history.trust_trajectory() for user, history in histories if history is not None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar subtask histories")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, description in (("import", "append the csv rows missing from the columnar histories"),
+                                  ("export", "write the columnar histories as csv to another folder")):
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument("users", nargs="*", help="users to convert, every user if not given")
+        subparser.add_argument("--config-dir", default=DEFAULT_CONFIG_DIR)
+        if command == "export":
+            subparser.add_argument("--output", required=True, help="folder receiving the csv histories")
+    for command in ("trajectory", "conformance"):
+        subparser = subparsers.add_parser(command, help="print the %s of a user" % command)
+        subparser.add_argument("user")
+        subparser.add_argument("--config-dir", default=DEFAULT_CONFIG_DIR)
+    args = parser.parse_args()
+    columnar = ColumnarStorage(args.config_dir)
+    if args.command in ("import", "export"):
+        for user in args.users or columnar.list_users():
+            if args.command == "import":
+                print(user, columnar.import_csv(user), "rows imported")
+            else:
+                print(user, columnar.export_csv(user, FileStorage(args.output)), "rows exported")
+        return
+    history = columnar.open_history(args.user)
+    if history is None:
+        parser.error("No columnar history for " + args.user)
+    if args.command == "trajectory":
+        trajectory = history.trust_trajectory()
+        print("subtask trust distrust uncertainty kinship")
+        for i, values in enumerate(zip(*(trajectory[key] for key in ("trust", "distrust", "uncertainty",
+                                                                      "kinship")))):
+            print(i, *values)
+    else:
+        summary = history.conformance_distribution()
+        print("conformance of", summary["count"], "subtasks")
+        for count, low, high in zip(summary["counts"], summary["edges"][:-1], summary["edges"][1:]):
+            print("%.2f-%.2f %d" % (low, high, count))
+
+
+if __name__ == "__main__":
+    main()
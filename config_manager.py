@@ -2,24 +2,148 @@
 File to read and update configuration for a user
 If file does not exist create a configuration
 yaml is file type for configuration
+The configuration is kept in memory once read, updates are written back
+right away or coalesced and flushed later when a flush interval is given
+Where the configuration lives is decided by the storage backend, yaml files in the config folder by default
 """
+import atexit
+import logging
 import os
 import sys
-import yaml
+import threading
+from contextlib import contextmanager
+import instrumentation
+import storage
 from utils import *
 DIR_NAME = os.path.dirname(__file__)
+logger = logging.getLogger(__name__)
+
+# Callables called with user, storage and configuration every time a configuration is written
+persist_listeners = []
+# Callables called with user, storage and configuration every time a configuration is updated in memory
+update_listeners = []
+# Configurations with updates not written yet, kept until they are written so none is lost when the process ends
+_pending_configs = set()
+
+
+def add_persist_listener(listener):
+    """
+    Registers a callable(user, storage, config) called after every configuration write of this process
+    """
+    persist_listeners.append(listener)
+
+
+def remove_persist_listener(listener):
+    if listener in persist_listeners:
+        persist_listeners.remove(listener)
+
+
+def add_update_listener(listener):
+    """
+    Registers a callable(user, storage, config) called after every configuration update of this process,
+    before the update is written when writes are coalesced
+    """
+    update_listeners.append(listener)
+
+
+def remove_update_listener(listener):
+    if listener in update_listeners:
+        update_listeners.remove(listener)
+
+
+def _notify(listeners, user, user_storage, config):
+    for listener in list(listeners):
+        try:
+            listener(user, user_storage, config)
+        except Exception as e:
+            logger.error("Configuration listener failed for %s due to %s", user, e)
+
+
+def notify_persisted(user, user_storage, config):
+    """
+    Passes a written configuration to the persist listeners, a failing listener does not fail the write
+    """
+    _notify(persist_listeners, user, user_storage, config)
+
+
+def flush_pending():
+    """
+    Writes the pending updates of every configuration, called once when the process ends
+    """
+    for manager in list(_pending_configs):
+        manager.flush()
+
+
+atexit.register(flush_pending)
+
+
+def default_config():
+    """
+    @return: configuration of a user seen for the first time
+    """
+    return {
+        ATTITUDE: 1,
+        RESPONSE_TIME: 2,
+        KINSHIP: None,
+        PREDICTOR_THRESHOLD: 0.5,
+        POSITIVE_EXP_COUNT: 0,
+        NEGATIVE_EXP_COUNT: 0,
+        # GOALS_ACHIEVED: 0,
+        MISSIONS_WORKED_TOGETHER: 0,
+        TRUST: 0,
+        DISTRUST: 0,
+        UNCERTAINTY: 0
+    }
+
 
 class ConfigManger(object):
 
-    def __init__(self, username):
+    __slots__ = ("user", "storage", "config", "flush_interval", "shared", "dirty", "lock", "flush_timer")
+
+    def __init__(self, username, flush_interval=None, user_storage=None, shared=False):
         """
         Creates configuration in current working directory config folder
         :param username:configuration file name
+        :param flush_interval: None writes every update to disk right away,
+            otherwise updates are kept in memory and written at most once per flush_interval seconds
+        :param user_storage: storage backend, the yaml files of the config folder if not given
+        :param shared: the user is updated by other processes too, the configuration is reloaded
+            when the user lock is taken and written before it is released, flush_interval is ignored
         """
         self.user = username
-        self.config_path = os.path.join(DIR_NAME, "config", username + ".yaml")
-        print(DIR_NAME)
+        self.storage = user_storage or storage.default_storage
+        logger.debug("Configuration of %s kept in %s", username, type(self.storage).__name__)
         self.config = None
+        self.flush_interval = None if shared else flush_interval
+        self.shared = shared
+        self.dirty = False
+        self.lock = self.storage.lock(username)
+        self.flush_timer = None
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds the user lock around a read, modify and write of the configuration
+        Shared configurations are reloaded from the storage when the lock is taken
+        and written back when it is released
+        @return: True when the configuration was reloaded
+        """
+        outermost = self.lock.acquire()
+        try:
+            reloaded = False
+            if outermost and self.shared and self.config is not None and not self.dirty:
+                with instrumentation.timer(self.user, "config_io"):
+                    latest = self.storage.load_config(self.user)
+                if latest is not None:
+                    # Update in place, Predictors holds a reference to the same dict
+                    self.config.clear()
+                    self.config.update(latest)
+                    reloaded = True
+            yield reloaded
+            if outermost and self.shared:
+                self.flush()
+        finally:
+            self.lock.release()
 
     def fetch_config(self):
         """
@@ -27,49 +151,86 @@ class ConfigManger(object):
         If exists read the configuration and fetch the data
         @return: the config data
         """
+        if self.config is not None:
+            return self.config
+
+        with self.lock:
+            self.create_config()
+        return self.config
 
-        if not os.path.isfile(self.config_path):
+    def create_config(self):
+        """
+        Reads the configuration from the storage, writing the default one if the user has none
+        """
+        with instrumentation.timer(self.user, "config_io"):
+            self.config = self.storage.load_config(self.user)
+        if self.config is None:
             # Data to be written
             try:
-
-                if not os.path.isdir(os.path.dirname(self.config_path)):
-                    os.makedirs(os.path.dirname(self.config_path))
-                self.config = {
-                    ATTITUDE: 1,
-                    RESPONSE_TIME: 2,
-                    KINSHIP: None,
-                    PREDICTOR_THRESHOLD: 0.5,
-                    POSITIVE_EXP_COUNT: 0,
-                    NEGATIVE_EXP_COUNT: 0,
-                    # GOALS_ACHIEVED: 0,
-                    MISSIONS_WORKED_TOGETHER: 0,
-                    TRUST: 0,
-                    DISTRUST: 0,
-                    UNCERTAINTY: 0
-                }
-                # Serializing json
-                yaml_object = yaml.dump(self.config, indent=4)
-
-                # Writing to sample.json
-                with open(self.config_path, "w") as outfile:
-                    outfile.write(yaml_object)
+                self.config = default_config()
+                self.storage.save_config(self.user, self.config)
             except Exception as e:
-                print("Config creation failed due to", e)
+                logger.error("Config creation failed due to %s", e)
                 sys.exit(1)
-
-        else:
-            with open(self.config_path, "r") as outfile:
-                self.config = yaml.safe_load(outfile)
-        return self.config
+            notify_persisted(self.user, self.storage, self.config)
 
     def update_config(self, key_value_map: dict):
         """
         updates the existing configuration with given dictionary
+        The in memory configuration is updated right away, the file when the update is flushed
         @param key_value_map: dict
         """
-        with open(self.config_path, "r") as outfile:
-            self.config = yaml.safe_load(outfile)
-
-        with open(self.config_path, "w") as outfile:
+        with self.locked():
+            if self.config is None:
+                self.fetch_config()
             self.config.update(key_value_map)
-            yaml.dump(self.config, outfile)
+            self.changed()
+
+    def remove_config(self, keys: list):
+        """
+        Removes keys from the configuration, written as update_config writes
+        @param keys: keys to remove, keys the configuration does not have are ignored
+        """
+        with self.locked():
+            if self.config is None:
+                self.fetch_config()
+            if not any(key in self.config for key in keys):
+                return
+            for key in keys:
+                self.config.pop(key, None)
+            self.changed()
+
+    def changed(self):
+        """
+        Marks the in memory configuration as updated and writes it, now or when the flush timer runs
+        Called under the user lock
+        """
+        self.dirty = True
+        if update_listeners:
+            _notify(update_listeners, self.user, self.storage, self.config)
+        if self.shared:
+            # Written when the lock is released
+            return
+        if self.flush_interval is None:
+            self.flush()
+        elif self.flush_timer is None:
+            _pending_configs.add(self)
+            self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        """
+        Writes the configuration to the storage if it has pending updates
+        """
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            _pending_configs.discard(self)
+            if not self.dirty:
+                return
+            with instrumentation.timer(self.user, "config_io"):
+                self.storage.save_config(self.user, self.config)
+            self.dirty = False
+            notify_persisted(self.user, self.storage, self.config)
@@ -0,0 +1,123 @@
+"""
+Append only log of the subtasks handled by a user
+Each subtask adds one row at the end of the user history, past rows are never loaded or rewritten
+"""
+import atexit
+import sys
+import instrumentation
+import storage
+
+# Logs holding buffered rows, kept until the rows are written so none is lost when the process ends normally
+_pending_logs = set()
+
+
+def flush_pending():
+    """
+    Writes the buffered rows of every log, called once when the process ends
+    """
+    for log in list(_pending_logs):
+        log.flush()
+
+
+atexit.register(flush_pending)
+
+
+def row_size(row: list):
+    """
+    @return: bytes of memory held by a row and its values, response lists included
+    """
+    size = sys.getsizeof(row)
+    for value in row:
+        size += sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class HistoryLog(object):
+
+    __slots__ = ("user", "columns", "flush_every", "max_buffer_bytes", "storage", "buffer", "buffer_bytes")
+
+    def __init__(self, user: str, columns: list, flush_every: int = 1, user_storage=None,
+                 max_buffer_bytes: int = None):
+        """
+        Creates the history of the user if it does not exist yet
+        @param user: user whose subtasks are logged
+        @param columns: column names of a row
+        @param flush_every: number of rows buffered in memory before they are written
+        @param user_storage: storage backend, the csv files of the config folder if not given
+        @param max_buffer_bytes: buffered rows are also written once they hold this much memory, no limit if not given
+        """
+        self.user = user
+        self.columns = columns
+        self.flush_every = max(1, flush_every)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.storage = user_storage or storage.default_storage
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.storage.create_history(self.user, self.columns)
+
+    def append(self, row: list):
+        """
+        Adds one row, written right away unless rows are buffered
+        @param row: values in the order of the columns
+        """
+        self.buffer.append(row)
+        if self.max_buffer_bytes is not None:
+            self.buffer_bytes += row_size(row)
+        if self.is_full():
+            self.flush()
+        elif self.buffer:
+            _pending_logs.add(self)
+
+    def extend(self, rows: list):
+        """
+        Adds several rows, written together once the buffer is full
+        @param rows: list of rows, each with values in the order of the columns
+        """
+        self.buffer.extend(rows)
+        if self.max_buffer_bytes is not None:
+            self.buffer_bytes += sum(row_size(row) for row in rows)
+        if self.is_full():
+            self.flush()
+        elif self.buffer:
+            _pending_logs.add(self)
+
+    def is_full(self):
+        return len(self.buffer) >= self.flush_every or (self.max_buffer_bytes is not None and
+                                                         self.buffer_bytes >= self.max_buffer_bytes)
+
+    def flush(self):
+        """
+        Writes the buffered rows at the end of the history
+        """
+        if not self.buffer:
+            return
+        with self.storage.lock(self.user), instrumentation.timer(self.user, "history_io"):
+            self.storage.append_history(self.user, self.columns, self.buffer)
+        self.buffer = []
+        self.buffer_bytes = 0
+        _pending_logs.discard(self)
+
+    def iter_rows(self):
+        """
+        Streams the history one row at a time
+        @return: iterator of dict, column name to value
+        """
+        self.flush()
+        return self.storage.iter_history(self.user)
+
+    def iter_chunks(self, chunksize: int = 10000):
+        """
+        Streams the history as DataFrames of at most chunksize rows
+        @return: iterator of DataFrame
+        """
+        import pandas as pd
+        chunk = []
+        for row in self.iter_rows():
+            chunk.append(row)
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=self.columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=self.columns)
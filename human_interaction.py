@@ -1,8 +1,11 @@
-from trust import Trust
-from predictors import Predictors
+from trust import Trust, probability_value
+from predictors import Predictors, SubtaskStatistics
+from history import HistoryLog
+from journal import Journal
+import storage
 from utils import *
+import instrumentation
 import os
-import pandas as pd
 """
 Flow of steps
 1. Get the user details and count of subtask
@@ -18,36 +21,85 @@ Flow of steps
 
 """
 DIR_NAME = os.path.dirname(__file__)
+# mission is the number of missions finished before the subtask, it changes wherever update_kinship ended a mission
+HISTORY_COLUMNS = ["Task", "positive exp Count", "negative exp Count", "Trust", "Distrust", "Uncertainty", "Kinship",
+                   "Competency", "Conformance", "reliability", "actual time", "expected time", "goalstatus",
+                   "actual response time", "role", "predictor_value", "mission"]
+# Arguments of calculate_trust, in order
+SUBTASK_FIELDS = ("role", "expected_time_for_task", "actual_response_list", "sub_task_status", "actual_time_for_task",
+                  "goal")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_subtask(record):
+    """
+    Checks the calculate_trust arguments of a subtask before anything is applied
+    @param record: dict of the calculate_trust arguments or a list of them in order
+    @raise ValueError: when a value cannot be used, actual_response_list and goal may be left out
+    """
+    if not isinstance(record, dict):
+        if not isinstance(record, (list, tuple)) or len(record) > len(SUBTASK_FIELDS):
+            raise ValueError("A subtask is a dict or a list of the calculate_trust arguments")
+        record = dict(zip(SUBTASK_FIELDS, record))
+    if record.get("role") not in (1, 2, 3) or isinstance(record.get("role"), bool):
+        raise ValueError("role must be 1, 2 or 3")
+    if record.get("sub_task_status") not in (0, 1) or isinstance(record.get("sub_task_status"), bool):
+        raise ValueError("sub_task_status must be 0 or 1")
+    for field in ("expected_time_for_task", "actual_time_for_task"):
+        if not _is_number(record.get(field)) or record[field] < 0:
+            raise ValueError(field + " must be a number of minutes")
+    responses = record.get("actual_response_list", [])
+    if not isinstance(responses, list) or not all(_is_number(value) and value >= 0 for value in responses):
+        raise ValueError("actual_response_list must be a list of numbers of minutes")
+    if not isinstance(record.get("goal", ""), str):
+        raise ValueError("goal must be a string")
+
 
 class InteractionAPI:
 
-    def __init__(self, user: str):
+    # A session holds a fixed set of attributes, the state kept per live user does not grow with its missions
+    __slots__ = ("user", "journal", "user_predictor", "statistics", "cols", "history")
+
+    def __init__(self, user: str, history_flush_every: int = 1, config_flush_interval: float = None,
+                 user_storage=None, shared: bool = False, journal: bool = False,
+                 journal_compact_every: int = 1000, history_buffer_bytes: int = None):
         """
         @param user: user who is interacting with robot.
         Name has to be unique for each other as we will create a config file with the name
+        @param history_flush_every: number of subtask rows buffered before they are appended to the history
+        @param config_flush_interval: seconds between configuration writes, None writes every update
+        @param user_storage: storage backend for configuration and history, yaml and csv files if not given
+        @param shared: other processes update the same user, state is reloaded and written under a file lock
+        @param journal: every update is journaled and synced before it is applied, and updates a crash kept
+        from the configuration or history are replayed here, see journal.py. Not available with shared
+        @param journal_compact_every: journaled updates after which configuration and history are synced
+        and the journal is emptied
+        @param history_buffer_bytes: buffered history rows are also written once they hold this many bytes,
+        no limit if not given. Only the history buffer is bounded by it
         """
-        self.user_predictor = Predictors(user)
-        self.predictor_deviation = []
-        self.sub_goal_status = []
-        
-        
-        self.csv_file_path =os.path.join(DIR_NAME, "config", user + "api21less.csv")
-        self.cols = ["Task", "positive exp Count", "negative exp Count", "Trust", "Distrust", "Uncertainty",  "Kinship",\
-                 "Competency", "Conformance", "reliability", "actual time", "expected time", "goalstatus", \
-                    "actual response time",  "role", "predictor_value"]
-        if not os.path.isfile(self.csv_file_path):
-
-            self.data=pd.DataFrame([],columns=self.cols)
-            self.data.to_csv(self.csv_file_path,index=False)
-        else:
-            self.data = pd.read_csv(self.csv_file_path)
+        self.user = user
+        self.journal = None
+        if journal:
+            if shared:
+                raise Exception("A journal cannot be kept for a shared user")
+            user_storage = user_storage or storage.default_storage
+            self.journal = Journal(user, user_storage, journal_compact_every)
+            with user_storage.lock(user):
+                self.journal.recover(HISTORY_COLUMNS)
+        self.user_predictor = Predictors(user, config_flush_interval, user_storage, shared)
+        self.statistics = SubtaskStatistics()
+        self.cols = HISTORY_COLUMNS
+        self.history = HistoryLog(user, self.cols, history_flush_every, user_storage, history_buffer_bytes)
 
     def update_exp_response_time(self, response_time: float):
         """
         Function to update response time in configuration file
         @param response_time: float value
         """
-        self.user_predictor.update_details_in_config({RESPONSE_TIME: response_time})
+        self.update_settings({RESPONSE_TIME: response_time})
 
     def update_experience_count(self, positive: int = None, negative: int = None):
         """
@@ -61,7 +113,7 @@ class InteractionAPI:
             updated_dict[POSITIVE_EXP_COUNT] = positive
         if negative is not None:
             updated_dict[NEGATIVE_EXP_COUNT] = negative
-        self.user_predictor.update_details_in_config(updated_dict)
+        self.update_settings(updated_dict)
 
     def update_attitude(self, attitude: float):
         """
@@ -70,7 +122,7 @@ class InteractionAPI:
         """
         # if attitude not in [0, 1]:
         #     raise Exception("Value must be 0 or 1")
-        self.user_predictor.update_details_in_config({ATTITUDE: attitude})
+        self.update_settings({ATTITUDE: attitude})
 
     def update_initial_kinship(self, kinship: float):
         """
@@ -79,7 +131,7 @@ class InteractionAPI:
         """
         if kinship < 0 or kinship > 1:
             raise Exception("Value must be in between 0 or 1")
-        self.user_predictor.update_details_in_config({KINSHIP: kinship})
+        self.update_settings({KINSHIP: kinship})
 
     def update_predictor_threshold(self, predictor_threshold: float):
         """
@@ -88,7 +140,29 @@ class InteractionAPI:
         """
         if predictor_threshold < 0 or predictor_threshold > 1:
             raise Exception("Value must be in between 0 or 1")
-        self.user_predictor.update_details_in_config({PREDICTOR_THRESHOLD: predictor_threshold})
+        self.update_settings({PREDICTOR_THRESHOLD: predictor_threshold})
+
+    def update_settings(self, updated_dict: dict):
+        """
+        Writes configuration values, journaled first when the session keeps a journal
+        """
+        with self.user_predictor.locked():
+            self.journal_update(updated_dict)
+            self.user_predictor.update_details_in_config(updated_dict)
+
+    def journal_update(self, config: dict, rows: list = ()):
+        """
+        Journals an update before it is applied, does nothing without a journal
+        """
+        if self.journal is not None:
+            self.journal.append(config, rows)
+
+    def compact_journal(self):
+        """
+        Empties the journal once it holds enough updates, after the configuration and history are written
+        """
+        if self.journal is not None and self.journal.needs_compaction():
+            self.flush()
 
     def calculate_trust(self, role: int, expected_time_for_task: float, actual_response_list: list,
                         sub_task_status: int, actual_time_for_task: float, goal=""):
@@ -100,35 +174,162 @@ class InteractionAPI:
         @param sub_task_status: status of subtask. Value must be 0 or 1
         @param actual_time_for_task: float value actual time in minutes within human finished the subtask
         """
-        positive_count, negative_count, kinship = self.user_predictor.get_details()
-        c, s = self.user_predictor.calculate_competency(role, sub_task_status)
-        co = self.user_predictor.calculate_conformance(actual_time_for_task, expected_time_for_task,
-                                                       actual_response_list)
-        self.sub_goal_status.append(sub_task_status)
-        r = self.user_predictor.calculate_reliability(self.sub_goal_status)
+        instrumentation.count(self.user, "calculate_trust")
+        with self.user_predictor.locked():
+            positive_count, negative_count, kinship = self.user_predictor.get_details()
+            row = self.apply_subtask(positive_count, negative_count, kinship, role, expected_time_for_task,
+                                     actual_response_list, sub_task_status, actual_time_for_task, goal)
+            self.journal_update(self.trust_update(row), [row])
+            self.user_predictor.update_details(row[1], row[2], row[3], row[4], row[5])
+            self.history.append(row)
+            self.compact_journal()
+
+    def calculate_trust_batch(self, records: list):
+        """
+        Function to calculate trust for several subtasks reported together, applied in the given order
+        Each subtask is handled as calculate_trust does, the configuration is written once and
+        the history rows are appended together at the end
+        Either every subtask is applied or none is, a failing subtask leaves the mission statistics as they were
+        @param records: list of subtasks, each a dict of the calculate_trust arguments or a list of them in order
+        @return: list of (trust, distrust, uncertainty, predictor value), one per subtask
+        @raise ValueError: when a subtask cannot be used, before any subtask is applied
+        """
+        instrumentation.count(self.user, "calculate_trust_batch")
+        if not records:
+            return []
+        for record in records:
+            validate_subtask(record)
+        with self.user_predictor.locked():
+            positive_count, negative_count, kinship = self.user_predictor.get_details()
+            statistics = self.statistics.copy()
+            rows = []
+            try:
+                for record in records:
+                    if isinstance(record, dict):
+                        row = self.apply_subtask(positive_count, negative_count, kinship, **record)
+                    else:
+                        row = self.apply_subtask(positive_count, negative_count, kinship, *record)
+                    positive_count, negative_count = row[1], row[2]
+                    rows.append(row)
+            except BaseException:
+                # Predictors exit on values they cannot use, SystemExit restores the statistics as well
+                self.statistics = statistics
+                raise
+            last = rows[-1]
+            self.journal_update(self.trust_update(last), rows)
+            self.user_predictor.update_details(last[1], last[2], last[3], last[4], last[5])
+            self.history.extend(rows)
+            self.compact_journal()
+        return [(row[3], row[4], row[5], row[15]) for row in rows]
+
+    @staticmethod
+    def trust_update(row: list):
+        """
+        @return: configuration values written after the subtask of a history row
+        """
+        return {POSITIVE_EXP_COUNT: row[1], NEGATIVE_EXP_COUNT: row[2], TRUST: row[3], DISTRUST: row[4],
+                UNCERTAINTY: row[5]}
+
+    def apply_subtask(self, positive_count: int, negative_count: int, kinship: float, role: int,
+                      expected_time_for_task: float, actual_response_list: list, sub_task_status: int,
+                      actual_time_for_task: float, goal=""):
+        """
+        Runs one subtask through the predictors and Trust without writing anything
+        @param positive_count: positive experience count before the subtask
+        @param negative_count: negative experience count before the subtask
+        @param kinship: kinship of the current mission
+        @return: history row of the subtask, in the order of HISTORY_COLUMNS
+        """
+        with instrumentation.timer(self.user, "competency"):
+            c, s = self.user_predictor.calculate_competency(role, sub_task_status)
+        with instrumentation.timer(self.user, "conformance"):
+            co = self.user_predictor.calculate_conformance(actual_time_for_task, expected_time_for_task,
+                                                           actual_response_list)
+        with instrumentation.timer(self.user, "reliability"):
+            self.statistics.add_status(sub_task_status)
+            r = self.user_predictor.calculate_running_reliability(self.statistics)
         is_positive, p_deviation, predictor_value = self.user_predictor.calculate_experience_type(c, co, r)
         if is_positive:
             positive_count = positive_count + 1
         else:
             negative_count = negative_count + 1
-        self.predictor_deviation.append(p_deviation)
-        tr = Trust(positive_count, negative_count, kinship)
-        t, d, u = tr.update_trust_vector()
-        self.user_predictor.update_details(positive_count, negative_count, t, d, u)
-        
-        
-        
-        self.data = pd.concat([self.data, pd.DataFrame([[goal,positive_count, negative_count, t, d, u, kinship, \
-                                               c, co, r, actual_time_for_task, expected_time_for_task, \
-                                               sub_task_status, actual_response_list,
-                                               role, predictor_value]], columns=self.cols)])
-        self.data.to_csv(self.csv_file_path, index=False)
+        self.statistics.add_deviation(sub_task_status, p_deviation)
+        with instrumentation.timer(self.user, "certainty"):
+            tr = Trust(positive_count, negative_count, kinship)
+            t, d, u = tr.update_trust_vector()
+        return [goal, positive_count, negative_count, t, d, u, kinship,
+                c, co, r, actual_time_for_task, expected_time_for_task,
+                sub_task_status, actual_response_list,
+                role, predictor_value, self.user_predictor.total_goals]
 
     def update_kinship(self):
         """
         This function calculates kinship and updates in the configuration
+        The mission ends here, the next subtasks start a new mission
+        """
+        instrumentation.count(self.user, "update_kinship")
+        with self.user_predictor.locked():
+            self.user_predictor.calculate_kinship_from_sum(self.statistics.deviation_sum,
+                                                          self.statistics.deviation_count)
+            config = self.user_predictor.config
+            self.journal_update({MISSIONS_WORKED_TOGETHER: config[MISSIONS_WORKED_TOGETHER],
+                                 KINSHIP: config[KINSHIP]})
+            self.compact_journal()
+        self.start_mission()
+
+    def start_mission(self):
+        """
+        Starts a new mission in the same session, the running statistics of the finished mission are dropped
+        Called by update_kinship, and to abandon a mission without updating kinship
+        """
+        self.statistics = SubtaskStatistics()
+
+    def suspend_mission(self):
+        """
+        Saves the running statistics of an unfinished mission with the configuration and writes the session,
+        called before the session is dropped so the next session of the user continues the mission
+        """
+        with self.user_predictor.locked():
+            if self.statistics.deviation_count:
+                self.update_settings({MISSION_IN_PROGRESS: self.statistics.as_dict()})
+        self.flush()
+
+    def resume_mission(self):
+        """
+        Continues the mission saved by suspend_mission, the saved statistics are removed from the configuration
+        as the live session keeps them from now on
+        """
+        with self.user_predictor.locked():
+            saved = self.user_predictor.config.get(MISSION_IN_PROGRESS)
+            if saved is None:
+                return
+            self.statistics = SubtaskStatistics.from_dict(saved)
+            self.journal_update({MISSION_IN_PROGRESS: None})
+            self.user_predictor.config_manager.remove_config([MISSION_IN_PROGRESS])
+
+    def read_history(self):
+        """
+        Streams the subtask history of the user from disk
+        :return: iterator of dict, one per subtask
+        """
+        return self.history.iter_rows()
+
+    def flush(self):
+        """
+        Writes any buffered subtask rows to the history and pending configuration updates
+        """
+        with self.user_predictor.locked():
+            self.user_predictor.config_manager.flush()
+            self.history.flush()
+            if self.journal is not None:
+                self.journal.compact()
+
+    def get_metrics(self):
+        """
+        Stage timings and call counts of this user, recorded while instrumentation is enabled
+        :return: dict with "stages" and "calls", see instrumentation.get_metrics
         """
-        self.user_predictor.calculate_kinship(self.sub_goal_status, self.predictor_deviation)
+        return instrumentation.get_metrics(self.user).get(self.user, {"stages": {}, "calls": {}})
 
     def get_trust_values(self):
         """
@@ -143,21 +344,5 @@ class InteractionAPI:
         consider human suggestion
         :return:Float probability value 
         """
-        trust, distrust, uncertainty = self.get_trust_values()   
-        p = 0 
-        if not (trust or distrust):
-            # print("First interaction") 
-            p = 1
-        elif uncertainty > (trust + distrust):
-            # print("Always work with human as robot is not certain")
-            p = 1
-        elif trust >= distrust:
-            # print("Trust value is more. Robot works with human")
-            p = 1
-        elif trust < distrust:
-            # print("Distrust value is more. So robot works with human with a probability of ",
-            #         round((1 - (distrust - trust) / (trust + distrust)), 2))
-            # self.message = "Distrust value is more. So robot works with probability of " + \
-            p = (1 - ((distrust - trust) / (trust + distrust)))
-        return p
-        
+        instrumentation.count(self.user, "fetch_probability_value")
+        return probability_value(*self.get_trust_values())
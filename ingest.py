@@ -0,0 +1,401 @@
+"""
+Ingestion of subtask events emitted by the robots as json lines
+Each source, a file that keeps growing or a FIFO, is read by its own thread into a bounded queue,
+so readers wait while the trust updates fall behind. Events are applied in micro batches, grouped
+per user in arrival order: subtasks through InteractionAPI.calculate_trust_batch and mission ends
+through update_kinship. Events whose update fails are appended to a dead letter file, itself a jsonl
+source that can be ingested again once the cause is fixed. After a batch is applied and written, the
+read offset of every file and the
+running statistics of every unfinished mission are saved in a checkpoint, a restarted daemon continues
+after the last applied event and a session evicted or restarted mid mission continues its mission
+    {"user": "user19", "role": 1, "expected_time_for_task": 10, "actual_response_list": [1.5],
+     "sub_task_status": 1, "actual_time_for_task": 9, "goal": "g1"}
+    {"user": "user19", "event": "mission_end"}
+    python ingest.py events/*.jsonl --checkpoint config/ingest_checkpoint.json
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import signal
+import stat
+import threading
+import time
+from human_interaction import validate_subtask
+from predictors import SubtaskStatistics
+from storage import DEFAULT_CONFIG_DIR, atomic_write, open_storage, valid_user_name
+from session_registry import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = os.path.join(DEFAULT_CONFIG_DIR, "ingest_checkpoint.json")
+DEFAULT_DEAD_LETTER = os.path.join(DEFAULT_CONFIG_DIR, "ingest_dead_letter.jsonl")
+SUBTASK = "subtask"
+MISSION_END = "mission_end"
+
+
+def parse_event(line: bytes):
+    """
+    Decodes and validates one event line
+    @return: event dict, "event" is SUBTASK or MISSION_END
+    @raise ValueError: when the line is not a valid event
+    """
+    event = json.loads(line)
+    if not isinstance(event, dict):
+        raise ValueError("event is not a json object")
+    if not valid_user_name(event.get("user")):
+        raise ValueError("event needs a user made of letters, digits, _ . and -")
+    kind = event.get("event", SUBTASK)
+    if kind == MISSION_END:
+        return {"user": event["user"], "event": MISSION_END}
+    if kind != SUBTASK:
+        raise ValueError("unknown event " + str(kind))
+    validate_subtask(event)
+    return {"user": event["user"], "event": SUBTASK, "role": event["role"],
+            "expected_time_for_task": event["expected_time_for_task"],
+            "actual_response_list": event.get("actual_response_list", []),
+            "sub_task_status": event["sub_task_status"], "actual_time_for_task": event["actual_time_for_task"],
+            "goal": event.get("goal", "")}
+
+
+class SourceReader(threading.Thread):
+    """
+    Reads the complete lines of one source into the queue as (path, offset after the line, event or None)
+    Files are followed as they grow and read again from the start when truncated or replaced,
+    a FIFO has no offset and stays open while writers come and go, a line left unfinished by a writer
+    that closed the FIFO is dropped
+    """
+
+    def __init__(self, path: str, events: queue.Queue, offset: int = 0, poll_interval: float = 0.2):
+        super().__init__(name="ingest " + path, daemon=True)
+        self.path = path
+        self.events = events
+        self.offset = offset
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.rejected = 0
+
+    def stop(self):
+        self.stopped.set()
+
+    def put(self, item):
+        # Waits while the queue is full, this is the back pressure on the source
+        while not self.stopped.is_set():
+            try:
+                self.events.put(item, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                continue
+
+    def emit(self, line: bytes, offset):
+        event = None
+        if line.strip():
+            try:
+                event = parse_event(line)
+            except ValueError as e:
+                self.rejected += 1
+                logger.warning("Rejected event at %s:%s: %s", self.path, offset, e)
+        # Rejected lines are still queued so the checkpoint moves past them
+        self.put((self.path, offset, event))
+
+    def run(self):
+        try:
+            if stat.S_ISFIFO(os.stat(self.path).st_mode):
+                self.read_fifo()
+            else:
+                self.read_file()
+        except Exception as e:
+            logger.error("Stopped reading %s due to %s", self.path, e)
+
+    def read_fifo(self):
+        # Opened non blocking so stop is noticed while no writer is connected. The descriptor stays open
+        # across writers: a read gives b"" while no writer is connected and data again once one connects
+        descriptor = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        pending = b""
+        try:
+            while not self.stopped.is_set():
+                try:
+                    data = os.read(descriptor, 65536)
+                except BlockingIOError:
+                    time.sleep(self.poll_interval / 10)
+                    continue
+                if not data:
+                    if pending:
+                        logger.warning("Writer of %s closed it in the middle of a line, dropped", self.path)
+                        self.rejected += 1
+                        pending = b""
+                    time.sleep(self.poll_interval / 10)
+                    continue
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    self.emit(line, None)
+        finally:
+            os.close(descriptor)
+
+    def read_file(self):
+        infile, inode, pending = None, None, b""
+        try:
+            while not self.stopped.is_set():
+                if infile is None:
+                    if not os.path.exists(self.path):
+                        time.sleep(self.poll_interval)
+                        continue
+                    infile = open(self.path, "rb")
+                    inode = os.fstat(infile.fileno()).st_ino
+                    if os.fstat(infile.fileno()).st_size < self.offset:
+                        logger.warning("%s is shorter than its checkpoint, read from the start", self.path)
+                        self.offset = 0
+                    infile.seek(self.offset)
+                line = infile.readline()
+                if line.endswith(b"\n"):
+                    self.offset += len(pending) + len(line)
+                    self.emit(pending + line, self.offset)
+                    pending = b""
+                    continue
+                # A partial last line is completed by a later write
+                pending += line
+                try:
+                    replaced = os.stat(self.path).st_ino != inode
+                except FileNotFoundError:
+                    replaced = True
+                if replaced or os.fstat(infile.fileno()).st_size < self.offset + len(pending):
+                    logger.info("%s was rotated or truncated, read from the start", self.path)
+                    infile.close()
+                    infile, pending, self.offset = None, b"", 0
+                    continue
+                time.sleep(self.poll_interval)
+        finally:
+            if infile is not None:
+                infile.close()
+
+
+class IngestionDaemon(object):
+
+    def __init__(self, paths: list, registry: SessionRegistry = None, checkpoint_path: str = DEFAULT_CHECKPOINT,
+                 batch_size: int = 512, batch_interval: float = 0.2, queue_size: int = 10000,
+                 poll_interval: float = 0.2, dead_letter_path: str = DEFAULT_DEAD_LETTER):
+        """
+        @param paths: jsonl files or FIFOs to read
+        @param registry: sessions the events are applied to, a new registry if not given
+        @param checkpoint_path: json file keeping the read offset of every file and the unfinished missions,
+            None for no checkpoint
+        @param batch_size: most events applied in one micro batch
+        @param batch_interval: seconds a batch waits to fill up before it is applied
+        @param queue_size: events read ahead of the updates before the readers wait
+        @param poll_interval: seconds between checks of a file that did not grow
+        @param dead_letter_path: jsonl file receiving the events whose update failed, None to only log them
+        """
+        self.paths = paths
+        self.registry = registry if registry is not None else SessionRegistry()
+        self.checkpoint_path = checkpoint_path
+        self.dead_letter_path = dead_letter_path
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+        self.events = queue.Queue(maxsize=max(1, queue_size))
+        # Running statistics of the missions not ended yet, kept here as sessions may be evicted mid mission
+        self.missions = {}
+        self.offsets = self.load_checkpoint()
+        self.readers = [SourceReader(path, self.events, self.offsets.get(path, 0), poll_interval)
+                        for path in paths]
+        self.stopped = threading.Event()
+        self.applied = 0
+        self.failed = 0
+        self.batches = 0
+
+    def load_checkpoint(self):
+        """
+        Reads the unfinished missions into self.missions
+        @return: dict of file path to the offset after the last applied event
+        """
+        if not self.checkpoint_path or not os.path.isfile(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as infile:
+            checkpoint = json.load(infile)
+        if not isinstance(checkpoint.get("offsets"), dict):
+            # Checkpoints of earlier versions hold the offsets only
+            return checkpoint
+        self.missions = {user: SubtaskStatistics.from_dict(values)
+                         for user, values in checkpoint.get("missions", {}).items()}
+        return checkpoint["offsets"]
+
+    def save_checkpoint(self):
+        if self.checkpoint_path:
+            missions = {user: statistics.as_dict() for user, statistics in self.missions.items()}
+            atomic_write(self.checkpoint_path, json.dumps({"offsets": self.offsets, "missions": missions},
+                                                          indent=4))
+
+    def next_batch(self):
+        """
+        Waits for the first event, then takes what arrives within batch_interval up to batch_size events
+        @return: list of (path, offset, event), empty when nothing arrived
+        """
+        batch = []
+        try:
+            batch.append(self.events.get(timeout=self.batch_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.events.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def apply_batch(self, batch: list):
+        """
+        Applies the events of a batch user by user, writes the sessions and saves the checkpoint
+        """
+        per_user = {}
+        for item in batch:
+            if item[2] is not None:
+                per_user.setdefault(item[2]["user"], []).append(item)
+        failed = []
+        for user, items in per_user.items():
+            applied, error = self.apply_user(user, [event for path, offset, event in items])
+            failed.extend(item + (error,) for item in items[applied:])
+        self.failed += len(failed)
+        if failed:
+            self.dead_letter(failed)
+        # Events are on disk before the offsets past them are
+        self.registry.flush_all()
+        for path, offset, event in batch:
+            if offset is not None:
+                self.offsets[path] = offset
+        self.save_checkpoint()
+        self.batches += 1
+
+    def apply_user(self, user: str, events: list):
+        """
+        Applies the events of one user in order, the mission in progress continues from self.missions
+        Stops at the first update that fails, the subtasks of one calculate_trust_batch fail together
+        @return: number of events applied, and the error the next event failed with or None
+        """
+        session, applied = None, 0
+        try:
+            session = self.registry.get(user)
+            if user in self.missions:
+                session.statistics = self.missions[user]
+            subtasks = []
+            for i, event in enumerate(events):
+                if event["event"] == SUBTASK:
+                    subtasks.append({key: value for key, value in event.items() if key not in ("user", "event")})
+                    continue
+                if subtasks:
+                    session.calculate_trust_batch(subtasks)
+                    applied, subtasks = i, []
+                if session.statistics.deviation_count == 0:
+                    logger.warning("Mission end of %s without subtasks, kinship not updated", user)
+                else:
+                    session.update_kinship()
+                applied = i + 1
+            if subtasks:
+                session.calculate_trust_batch(subtasks)
+                applied = len(events)
+            return applied, None
+        except Exception as e:
+            logger.error("%d events of %s failed due to %s", len(events) - applied, user, e)
+            return applied, "%s: %s" % (type(e).__name__, e)
+        finally:
+            self.applied += applied
+            if session is not None and session.statistics.deviation_count:
+                self.missions[user] = session.statistics
+            elif session is not None:
+                self.missions.pop(user, None)
+
+    def dead_letter(self, failed: list):
+        """
+        Appends the failed events to the dead letter file and syncs it, before the checkpoint moves past them
+        Each line is the event with the error, source and offset added, parse_event reads it as the event
+        @param failed: list of (path, offset, event, error)
+        """
+        lines = [json.dumps(dict(event, error=error, source=path, offset=offset)) + "\n"
+                 for path, offset, event, error in failed]
+        if not self.dead_letter_path:
+            for line in lines:
+                logger.error("Failed event dropped: %s", line.strip())
+            return
+        with open(self.dead_letter_path, "a") as outfile:
+            outfile.writelines(lines)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+    def start(self):
+        for reader in self.readers:
+            reader.start()
+
+    def run_forever(self):
+        """
+        Applies batches until stop is called, then applies what was already read
+        """
+        self.start()
+        while not self.stopped.is_set():
+            batch = self.next_batch()
+            if batch:
+                self.apply_batch(batch)
+        for reader in self.readers:
+            reader.stop()
+        for reader in self.readers:
+            reader.join()
+        while not self.events.empty():
+            self.apply_batch(self.next_batch())
+        self.registry.clear()
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        return {"applied": self.applied, "failed": self.failed, "batches": self.batches,
+                "rejected": sum(reader.rejected for reader in self.readers), "queued": self.events.qsize()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply subtask events from jsonl files or FIFOs")
+    parser.add_argument("paths", nargs="+", help="jsonl files or FIFOs to follow")
+    parser.add_argument("--storage", default=DEFAULT_CONFIG_DIR,
+                        help="config folder or sqlite .db file receiving the updates")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="file keeping the read offsets")
+    parser.add_argument("--dead-letter", default=DEFAULT_DEAD_LETTER,
+                        help="jsonl file receiving the events whose update failed")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--batch-interval", type=float, default=0.2)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--capacity", type=int, default=1024, help="live sessions kept in memory")
+    parser.add_argument("--trust-index", help="sqlite file of a trust index kept up to date with every update")
+    parser.add_argument("--trust-table", help="shared memory trust table receiving every update, created if needed")
+    parser.add_argument("--history-buffer-bytes", type=int, default=None,
+                        help="bytes of history rows a session buffers before they are written, no limit if not given")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("predictors").setLevel(logging.WARNING)
+    logging.getLogger("trust").setLevel(logging.WARNING)
+    user_storage = open_storage(args.storage)
+    index, table = None, None
+    if args.trust_index:
+        from trust_index import TrustIndex
+        index = TrustIndex(args.trust_index)
+        index.attach(user_storage)
+    if args.trust_table:
+        from shared_trust import open_table
+        table = open_table(args.trust_table)
+        table.attach(user_storage)
+    registry = SessionRegistry(args.capacity, user_storage=user_storage,
+                               history_buffer_bytes=args.history_buffer_bytes)
+    daemon = IngestionDaemon(args.paths, registry, args.checkpoint, args.batch_size, args.batch_interval,
+                             args.queue_size, dead_letter_path=args.dead_letter)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run_forever()
+    finally:
+        if index is not None:
+            index.close()
+        if table is not None:
+            table.close()
+    logger.info("Stopped after %s", daemon.stats())
+
+
+if __name__ == "__main__":
+    main()
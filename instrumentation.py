@@ -0,0 +1,140 @@
+"""
+Per stage timings and call counts of the trust pipeline
+Instrumentation is off by default and then costs one flag check per stage,
+enable() turns it on for the whole process
+Metrics are read with get_metrics and exported in the prometheus text format with export_prometheus
+"""
+import threading
+import time
+from contextlib import nullcontext
+from storage import atomic_write
+
+# Stages timed by the pipeline
+STAGES = ("competency", "conformance", "reliability", "certainty", "config_io", "history_io")
+
+enabled = False
+_lock = threading.Lock()
+# (user, stage) -> [calls, total seconds, max seconds]
+_stage_metrics = {}
+# (user, method) -> calls
+_call_counts = {}
+_null_timer = nullcontext()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """
+    Drops every recorded metric
+    """
+    with _lock:
+        _stage_metrics.clear()
+        _call_counts.clear()
+
+
+class _StageTimer(object):
+
+    __slots__ = ("user", "stage", "start")
+
+    def __init__(self, user, stage):
+        self.user = user
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.user, self.stage, time.perf_counter() - self.start)
+
+
+def timer(user: str, stage: str):
+    """
+    Context manager timing one stage for a user, does nothing while instrumentation is off
+    """
+    if not enabled:
+        return _null_timer
+    return _StageTimer(user or "", stage)
+
+
+def record(user: str, stage: str, seconds: float):
+    """
+    Adds one timed call of a stage
+    """
+    with _lock:
+        metric = _stage_metrics.get((user, stage))
+        if metric is None:
+            metric = _stage_metrics[(user, stage)] = [0, 0.0, 0.0]
+        metric[0] += 1
+        metric[1] += seconds
+        metric[2] = max(metric[2], seconds)
+
+
+def count(user: str, method: str):
+    """
+    Counts one call of an InteractionAPI method for a user
+    """
+    if not enabled:
+        return
+    with _lock:
+        _call_counts[(user or "", method)] = _call_counts.get((user or "", method), 0) + 1
+
+
+def get_metrics(user: str = None):
+    """
+    @param user: only return the metrics of this user if given
+    @return: dict of user to {"stages": {stage: {"calls", "total_seconds", "max_seconds"}}, "calls": {method: count}}
+    """
+    metrics = {}
+    with _lock:
+        for (metric_user, stage), (calls, total, maximum) in _stage_metrics.items():
+            if user is None or metric_user == user:
+                entry = metrics.setdefault(metric_user, {"stages": {}, "calls": {}})
+                entry["stages"][stage] = {"calls": calls, "total_seconds": total, "max_seconds": maximum}
+        for (metric_user, method), calls in _call_counts.items():
+            if user is None or metric_user == user:
+                metrics.setdefault(metric_user, {"stages": {}, "calls": {}})["calls"][method] = calls
+    return metrics
+
+
+def _label(value: str):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text():
+    """
+    @return: metrics in the prometheus text exposition format
+    """
+    lines = []
+    with _lock:
+        stage_metrics = sorted(_stage_metrics.items())
+        call_counts = sorted(_call_counts.items())
+    for name, kind, description, index in (
+            ("trust_stage_calls_total", "counter", "Timed calls of a pipeline stage", 0),
+            ("trust_stage_seconds_total", "counter", "Seconds spent in a pipeline stage", 1),
+            ("trust_stage_seconds_max", "gauge", "Slowest call of a pipeline stage", 2)):
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for (user, stage), metric in stage_metrics:
+            lines.append('%s{user="%s",stage="%s"} %s' % (name, _label(user), _label(stage), repr(metric[index])))
+    lines.append("# HELP trust_calls_total Calls of an InteractionAPI method")
+    lines.append("# TYPE trust_calls_total counter")
+    for (user, method), calls in call_counts:
+        lines.append('trust_calls_total{user="%s",method="%s"} %d' % (_label(user), _label(method), calls))
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path: str):
+    """
+    Writes the metrics in the prometheus text format, for example for the node exporter textfile collector
+    """
+    atomic_write(path, prometheus_text())
@@ -0,0 +1,131 @@
+"""
+Write ahead journal of the updates applied to a user
+Every update is appended to the journal and synced before the configuration and history are written,
+a crash between those writes is repaired on the next start by replaying the journal
+One json line per update:
+    {"history": 41, "config": {"trust": 0.5, ...}, "rows": [[...], ...]}
+history is the number of history rows written before the rows of the update, so a row is appended
+on replay only when the history is shorter, and configuration values are absolute, so replaying
+an update twice changes nothing
+Compaction makes the configuration and history durable and starts a new journal holding only
+the length of the history, {"history": 42}
+"""
+import json
+import logging
+import os
+from config_manager import default_config, notify_persisted
+from storage import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+
+    __slots__ = ("user", "storage", "path", "compact_every", "entries", "history_rows", "journal_file")
+
+    def __init__(self, user: str, user_storage, compact_every: int = 1000):
+        """
+        @param user: user whose updates are journaled, one journal per user and process
+        @param user_storage: storage of the configuration and history, must have a journal_path
+        @param compact_every: updates kept in the journal before InteractionAPI compacts it
+        """
+        self.user = user
+        self.storage = user_storage
+        self.path = user_storage.journal_path(user)
+        if self.path is None:
+            raise Exception(type(user_storage).__name__ + " does not keep a journal")
+        self.compact_every = max(1, compact_every)
+        self.entries = 0
+        self.history_rows = None
+        self.journal_file = None
+
+    def read(self):
+        """
+        @return: list of the journaled updates, a line torn by a crash and anything after it are left out
+        """
+        if not os.path.isfile(self.path):
+            return []
+        entries = []
+        with open(self.path, "r") as infile:
+            for line in infile:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Journal of %s ends with a torn update, ignored", self.user)
+                    break
+        return entries
+
+    def recover(self, columns: list):
+        """
+        Applies the journaled updates the configuration or history are missing and compacts the journal
+        Called under the user lock before the configuration is read
+        @param columns: history columns of the journaled rows
+        @return: number of updates replayed
+        """
+        entries = self.read()
+        updates = [entry for entry in entries if "config" in entry]
+        if not updates:
+            if entries:
+                self.history_rows = entries[0]["history"]
+            else:
+                # First use of the journal, the history length is counted once
+                self.history_rows = sum(1 for _ in self.storage.iter_history(self.user))
+                self.compact()
+            return 0
+        history_rows = sum(1 for _ in self.storage.iter_history(self.user))
+        config = default_config()
+        config.update(self.storage.load_config(self.user) or {})
+        missing = []
+        for entry in updates:
+            config.update(entry["config"])
+            for i, row in enumerate(entry.get("rows", [])):
+                if entry["history"] + i >= history_rows:
+                    missing.append(row)
+        self.storage.save_config(self.user, config)
+        notify_persisted(self.user, self.storage, config)
+        if missing:
+            # A history written before a column was added is upgraded before the journaled rows are appended
+            self.storage.create_history(self.user, columns)
+            self.storage.append_history(self.user, columns, missing)
+        logger.warning("Replayed %d journaled updates of %s, %d history rows were missing",
+                       len(updates), self.user, len(missing))
+        self.history_rows = history_rows + len(missing)
+        self.compact()
+        return len(updates)
+
+    def append(self, config: dict, rows: list = ()):
+        """
+        Journals one update and syncs it, the update is durable once this returns
+        @param config: configuration values set by the update
+        @param rows: history rows added by the update
+        """
+        if self.journal_file is None:
+            self.journal_file = open(self.path, "a")
+        entry = {"history": self.history_rows, "config": config}
+        if rows:
+            entry["rows"] = list(rows)
+        self.journal_file.write(json.dumps(entry) + "\n")
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.history_rows += len(rows)
+        self.entries += 1
+
+    def needs_compaction(self):
+        return self.entries >= self.compact_every
+
+    def compact(self):
+        """
+        Syncs the configuration and history and replaces the journal with the history length only
+        The caller writes every buffered configuration update and history row first
+        """
+        self.storage.sync(self.user)
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+        atomic_write(self.path, json.dumps({"history": self.history_rows}) + "\n")
+        self.entries = 0
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
@@ -0,0 +1,72 @@
+"""
+Per user locks held around configuration and history updates
+A re-entrant thread lock serializes threads of one process, an advisory fcntl lock on a
+per user lock file serializes processes. Locks of different users never contend
+"""
+import fcntl
+import os
+import threading
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class UserLock(object):
+
+    def __init__(self, path: str = None):
+        """
+        @param path: lock file shared by every process, None for a lock within this process only
+        """
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+
+    def acquire(self):
+        """
+        Takes the lock, re-entrant within a thread
+        @return: True if the lock was free in this process, False if this thread already held it
+        """
+        self.thread_lock.acquire()
+        self.depth += 1
+        if self.depth > 1:
+            return False
+        if self.path:
+            try:
+                self.lock_file = open(self.path, "a")
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.depth -= 1
+                self.thread_lock.release()
+                raise
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.lock_file is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def user_lock(key: str, path: str = None):
+    """
+    Returns the lock of a user, the same object for every caller in this process
+    @param key: identifies the user, usually the lock file path
+    @param path: lock file shared with other processes, None for a thread lock only
+    @return: UserLock
+    """
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            if path and not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            lock = _locks[key] = UserLock(path)
+        return lock
@@ -1,26 +1,160 @@
 from config_manager import ConfigManger
 from utils import *
-import pandas as pd
+import logging
 import sys
-from statistics import mean
+from contextlib import contextmanager
+from statistics import mean, variance
+
+logger = logging.getLogger(__name__)
+
+
+class SubtaskStatistics:
+    """
+    Running statistics over the subtasks of a session, updated in constant time and memory
+    Goal status variance is kept from exact integer sums, so it is the correctly rounded sample variance,
+    and falls back to Welford updates if a status is not an integer
+    """
+
+    __slots__ = ("count", "total", "total_squares", "mean", "m2", "minimum", "maximum", "exact", "deviation_sum",
+                 "deviation_count")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.exact = True
+        self.deviation_sum = 0
+        self.deviation_count = 0
+
+    def copy(self):
+        """
+        @return: statistics holding the same values, updated independently of these
+        """
+        statistics = SubtaskStatistics()
+        for name in self.__slots__:
+            setattr(statistics, name, getattr(self, name))
+        return statistics
+
+    def as_dict(self):
+        """
+        @return: dict of the running totals, json serializable
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values: dict):
+        """
+        @param values: dict given by as_dict
+        """
+        statistics = cls()
+        for name in cls.__slots__:
+            setattr(statistics, name, values[name])
+        return statistics
+
+    def add_status(self, status):
+        """
+        Adds the goal status of a subtask
+        """
+        self.count += 1
+        if self.exact and status == int(status):
+            self.total += int(status)
+            self.total_squares += int(status) * int(status)
+        else:
+            self.exact = False
+        delta = status - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (status - self.mean)
+        self.minimum = status if self.minimum is None else min(self.minimum, status)
+        self.maximum = status if self.maximum is None else max(self.maximum, status)
+
+    def add_deviation(self, status, deviation: float):
+        """
+        Adds the predictor deviation of a subtask, weighted by its goal status, for kinship
+        """
+        self.deviation_sum = self.deviation_sum + (status * deviation)
+        self.deviation_count += 1
+
+    def status_variance(self):
+        """
+        @return: sample variance of the goal status, NaN with less than two subtasks
+        """
+        if self.count < 2:
+            return float("nan")
+        if self.exact:
+            return (self.count * self.total_squares - self.total * self.total) / (self.count * (self.count - 1))
+        return self.m2 / (self.count - 1)
+
+
+def dev_time_to_goal(actual: float, expected: float):
+    """
+    Deviation between the actual and the expected time to finish a subtask
+    @return: 1 on time, lower as the subtask runs late, 0 if the expected time is not positive
+    """
+    if expected <= 0:
+        return 0
+    if actual <= expected:
+        return 1
+    return max(0, 1 - (abs(actual - expected) / expected))
+
+
+def dev_response_time(response_time_list: list, response_time: float):
+    """
+    Deviation between the actual response times of the interactions and the expected response time
+    @return: mean over the interactions, 0 without interactions
+    """
+    response_ratio = [1 if i <= response_time else max(0, 1 - (abs(i - response_time) / response_time))
+                      for i in response_time_list]
+    return mean(response_ratio) if response_ratio else 0
 
 
 class Predictors:
-    def __init__(self, username):
+
+    __slots__ = ("config_manager", "config", "predictor_value", "conformance_time_weight",
+                 "conformance_response_weight", "attitude", "response_time", "predictor_threshold", "kinship",
+                 "total_goals")
+
+    def __init__(self, username, flush_interval=None, user_storage=None, shared=False):
         """
         Reads the configuration based on the username provided
         :param username: username to fetch configuration details
+        :param flush_interval: seconds between configuration writes, None writes every update
+        :param user_storage: storage backend of the configuration, yaml files if not given
+        :param shared: the user is also updated by other processes, see ConfigManger
         """
-        self.config_manager = ConfigManger(username)
+        self.config_manager = ConfigManger(username, flush_interval, user_storage, shared)
         self.config = self.config_manager.fetch_config()
+        self.predictor_value = 0
+        # Share of the time to goal and response time deviations in conformance
+        self.conformance_time_weight = 0.75
+        self.conformance_response_weight = 0.25
+        self.load_settings()
+
+    def load_settings(self):
+        """
+        Copies the predictor settings from the configuration
+        """
         self.attitude = self.config[ATTITUDE]
         self.response_time = self.config[RESPONSE_TIME]
         self.predictor_threshold = self.config[PREDICTOR_THRESHOLD]
         self.kinship = self.config[KINSHIP]
-        self.predictor_value = 0
         self.total_goals = self.config[MISSIONS_WORKED_TOGETHER]
         # self.goals_achieved = self.config[GOALS_ACHIEVED]
 
+    @contextmanager
+    def locked(self):
+        """
+        Holds the user lock while a subtask or mission is applied,
+        settings are refreshed when another process changed the configuration
+        """
+        with self.config_manager.locked() as reloaded:
+            if reloaded:
+                self.load_settings()
+            yield
+
     def fetch_trust_values(self):
         """
         Fetch trust vector from configuration
@@ -43,7 +177,7 @@ class Predictors:
         """
         def assign_knowledge(role_value):
             if role_value not in [1, 2, 3]:
-                print("Enter valid role choice")
+                logger.error("Enter valid role choice")
                 sys.exit(1)
             if role_value == 1:
                 # If human role is just monitor robot assumes human does not have full information about the area
@@ -59,11 +193,11 @@ class Predictors:
         k = assign_knowledge(role)
         s = goal_status
         c = (k + s + self.attitude) / 3
-        print("Knowledge is ", k)
-        print("Skills is ", s)
-        print("Attitude is", self.attitude)
+        logger.debug("Knowledge is %s", k)
+        logger.debug("Skills is %s", s)
+        logger.debug("Attitude is %s", self.attitude)
 
-        print("Competency is", c)
+        logger.debug("Competency is %s", c)
         return c, s
 
     def calculate_conformance(self, actual_time: float, expected_time: float, interaction_list: list):
@@ -77,35 +211,16 @@ class Predictors:
             for each interaction while performing the subtask human has to respond to robot if requires
         @return: float value between 0 and 1
         """
-        def dev_time_to_goal(actual, expected):
-            print("Actual time taken to finish sub task in minutes", actual)
-            if expected_time<=0:
-                return 0
-            if actual <= expected:
-                return 1
-            return max(0, 1-(abs(actual - expected) / expected))
-
-        def dev_response_time(response_time_list):
-            """
-            expected response time is fetched from configuration file
-            """
-            print("Expected response time in minutes", self.response_time)
-            print("Actual response time in minutes", response_time_list)
-            response_ratio = []
-            for i in response_time_list:
-                if i <= self.response_time:
-                    response_ratio.append(1)
-                else:
-                    response_ratio.append(max(0, 1-(abs(i - self.response_time) / self.response_time)))
-            if response_ratio: return mean(response_ratio)
-            else: return 0
-
+        logger.debug("Actual time taken to finish sub task in minutes %s", actual_time)
+        # expected response time is fetched from configuration file
+        logger.debug("Expected response time in minutes %s", self.response_time)
+        logger.debug("Actual response time in minutes %s", interaction_list)
         dt = dev_time_to_goal(actual_time, expected_time)
-        dr = dev_response_time(interaction_list)
-        print("Deviation between actual and expected time to finish to task", dt)
-        print("Deviation between actual and expected response time", dr)
-        conformance = (3*dt/4 + dr/4)
-        print("Conformance is", conformance)
+        dr = dev_response_time(interaction_list, self.response_time)
+        logger.debug("Deviation between actual and expected time to finish to task %s", dt)
+        logger.debug("Deviation between actual and expected response time %s", dr)
+        conformance = (self.conformance_time_weight * dt + self.conformance_response_weight * dr)
+        logger.debug("Conformance is %s", conformance)
         return conformance
 
     def calculate_kinship(self, sub_goal_status: list, predictor_deviation: list):
@@ -123,19 +238,31 @@ class Predictors:
         sub_tasks_l = len(sub_goal_status)
         for i in range(sub_tasks_l):
             sum_d = sum_d + (sub_goal_status[i] * predictor_deviation[i])
+        return self.calculate_kinship_from_sum(sum_d, sub_tasks_l)
 
+    def calculate_kinship_from_sum(self, sum_d: float, sub_tasks_l: int):
+        """
+        Function to calculate kinship from running totals once the whole task(mission) is finished
+        @param sum_d: sum over subtasks of goal status times predictor deviation
+        @param sub_tasks_l: number of subtasks
+        @return: float value between 0 and 1
+        """
         if self.kinship:
-            print(self.total_goals * self.kinship, self.total_goals, self.kinship, sum_d, sub_tasks_l,
-                  sum_d / sub_tasks_l)
+            logger.debug("%s %s %s %s %s %s", self.total_goals * self.kinship, self.total_goals, self.kinship, sum_d,
+                         sub_tasks_l, sum_d / sub_tasks_l)
             self.kinship = ((self.total_goals * self.kinship) / (self.total_goals + 1)) + (
                         (sum_d / sub_tasks_l) / (self.total_goals + 1))
         else:
             self.kinship = (sum_d / sub_tasks_l) / (self.total_goals + 1)
-        print("Kinship is", self.kinship)
+        logger.info("Kinship is %s", self.kinship)
         updated_dict = {MISSIONS_WORKED_TOGETHER: self.total_goals + 1,
                         KINSHIP: float(round(self.kinship, 2))}
         self.config_manager.update_config(updated_dict)
-        return self.kinship
+        kinship = self.kinship
+        # A session kept for the next mission continues from the stored values
+        self.total_goals = self.total_goals + 1
+        self.kinship = updated_dict[KINSHIP]
+        return kinship
 
     def get_details(self):
         """
@@ -151,6 +278,8 @@ class Predictors:
         for key, value in dict_of_values.items():
             self.config[key] = value
         self.config_manager.update_config(dict_of_values)
+        # Settings are read from the copies load_settings makes, a live session must see the new values
+        self.load_settings()
 
     def calculate_reliability(self, status):
         """
@@ -160,14 +289,41 @@ class Predictors:
         If status of all goals is 1 then reliability is 1
         else reliability is 1-variance
         """
-        sr = pd.Series(status)
-        if (sr == 0).all():
+        try:
+            import pandas as pd
+        except ImportError:
+            # Without pandas fall back to the exact sample variance of the statistics module
+            pd = None
+        if pd is None:
+            if all(value == 0 for value in status):
+                reliability = 0
+            elif all(value == 1 for value in status):
+                reliability = 1
+            else:
+                reliability = 1 - variance(status)
+        else:
+            sr = pd.Series(status)
+            if (sr == 0).all():
+                reliability = 0
+            elif (sr == 1).all():
+                reliability = 1
+            else:
+                reliability = 1 - sr.var(skipna=True)
+        logger.debug("Reliability is %s", reliability)
+        return reliability
+
+    def calculate_running_reliability(self, subtask_statistics: SubtaskStatistics):
+        """
+        Same as calculate_reliability from running statistics instead of the whole status list
+        @subtask_statistics: SubtaskStatistics of the subtasks handled by human
+        """
+        if subtask_statistics.count == 0 or subtask_statistics.minimum == subtask_statistics.maximum == 0:
             reliability = 0
-        elif (sr == 1).all():
+        elif subtask_statistics.minimum == subtask_statistics.maximum == 1:
             reliability = 1
         else:
-            reliability = 1 - sr.var(skipna=True)
-        print("Reliability is", reliability)
+            reliability = 1 - subtask_statistics.status_variance()
+        logger.debug("Reliability is %s", reliability)
         return reliability
 
     def calculate_experience_type(self, competency: float, conformance: float, reliability: float):
@@ -178,15 +334,15 @@ class Predictors:
 
         @return: whether experience is positive(1) or negative(0)
         """
-        print("Predictor threshold is ", self.predictor_threshold)
+        logger.debug("Predictor threshold is %s", self.predictor_threshold)
         self.predictor_value = ((competency + reliability) / 6 ) + (2 * conformance / 3)
         predictor_deviation = max(0, self.predictor_value - (
                     abs(self.predictor_value - self.predictor_threshold) / self.predictor_threshold))
-        print("Predictor value = Competency+Conformance+Reliability/3", self.predictor_value)
+        logger.debug("Predictor value = Competency+Conformance+Reliability/3 %s", self.predictor_value)
         if self.predictor_threshold <= self.predictor_value:
-            print("Interaction is considered as positive experience")
+            logger.info("Interaction is considered as positive experience")
             return 1, 1, self.predictor_value
-        print("Interaction is considered as negative experience")
+        logger.info("Interaction is considered as negative experience")
 
         return 0, predictor_deviation, self.predictor_value
 
@@ -0,0 +1,185 @@
+"""
+Replays recorded subtask histories through the trust pipeline with different settings
+Every recorded subtask goes through competency, conformance, reliability, experience type and Trust again,
+the live configuration is never touched and the recomputed history is written to an output folder
+Mission boundaries are read from the mission column, the missions finished before each subtask, and the
+final mission is ended again when the recorded configuration counts more missions than the last subtask.
+Histories written before the column existed fall back to a mission ending wherever the recorded kinship changes
+Users are replayed in parallel processes
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from config_manager import default_config
+from human_interaction import InteractionAPI
+from storage import FileStorage, MemoryStorage, open_storage
+from utils import *
+
+# Settings a replay can override, the conformance weights default to the ones of Predictors
+SETTINGS = ("predictor_threshold", "attitude", "response_time", "initial_kinship",
+            "conformance_time_weight", "conformance_response_weight")
+
+
+class ReplayStorage(MemoryStorage):
+    """
+    Keeps the replayed configuration in memory and streams the replayed history to another storage
+    """
+
+    def __init__(self, output):
+        super().__init__()
+        self.output = output
+
+    def create_history(self, user: str, columns: list):
+        self.output.create_history(user, columns)
+
+    def append_history(self, user: str, columns: list, rows: list):
+        self.output.append_history(user, columns, rows)
+
+    def iter_history(self, user: str):
+        return self.output.iter_history(user)
+
+
+def mission_ends(previous: dict, row: dict):
+    """
+    @param previous: recorded subtask before row
+    @param row: recorded subtask
+    @return: True when a mission ended between the two subtasks
+    """
+    if previous.get("mission") is not None and row.get("mission") is not None:
+        return row["mission"] != previous["mission"]
+    # Older histories have no mission column, kinship only changes after a mission
+    return row["Kinship"] != previous["Kinship"]
+
+
+def count_missions(source, user: str):
+    """
+    @return: number of mission ends found in the history of the user
+    """
+    missions, previous = 0, None
+    for row in source.iter_history(user):
+        if previous is not None and mission_ends(previous, row):
+            missions += 1
+        previous = row
+    return missions
+
+
+def initial_config(user: str, source, settings: dict = None):
+    """
+    Configuration of the user before the first recorded subtask: kinship is read from that row, the
+    experience counts are the recorded ones minus its outcome, judged against the current predictor threshold,
+    and missions worked together are read from that row, or for older histories the recorded ones minus the
+    mission ends found in the history
+    @param source: storage holding the recorded configuration and history
+    @param settings: dict of SETTINGS overriding the recorded configuration
+    @return: configuration dict, None if the user has no history
+    """
+    settings = settings or {}
+    recorded = default_config()
+    recorded.update(source.load_config(user) or {})
+    first = next(iter(source.iter_history(user)), None)
+    if first is None:
+        return None
+
+    positive, negative = first["positive exp Count"], first["negative exp Count"]
+    if first["predictor_value"] >= recorded[PREDICTOR_THRESHOLD]:
+        positive = positive - 1
+    else:
+        negative = negative - 1
+    # No kinship yet means no mission was finished before the first recorded subtask
+    missions = 0
+    if first.get("mission") is not None:
+        missions = first["mission"]
+    elif first["Kinship"] is not None:
+        missions = max(0, recorded[MISSIONS_WORKED_TOGETHER] - count_missions(source, user))
+    config = dict(recorded)
+    config.update({POSITIVE_EXP_COUNT: positive, NEGATIVE_EXP_COUNT: negative, KINSHIP: first["Kinship"],
+                   MISSIONS_WORKED_TOGETHER: missions, TRUST: 0, DISTRUST: 0, UNCERTAINTY: 0})
+    for setting, key in (("predictor_threshold", PREDICTOR_THRESHOLD), ("attitude", ATTITUDE),
+                         ("response_time", RESPONSE_TIME), ("initial_kinship", KINSHIP)):
+        if settings.get(setting) is not None:
+            config[key] = settings[setting]
+    return config
+
+
+def replay_user(user: str, source, output, settings: dict = None):
+    """
+    Replays the history of one user, starting from the configuration given by initial_config
+    The mission of the last subtask is ended when the recorded configuration counts it as finished
+    @param source: storage holding the recorded configuration and history
+    @param output: storage receiving the replayed history and final configuration
+    @param settings: dict of SETTINGS overriding the recorded configuration
+    @return: number of subtasks replayed
+    """
+    settings = settings or {}
+    if next(iter(output.iter_history(user)), None) is not None:
+        raise Exception("Output already holds a history for " + user)
+    config = initial_config(user, source, settings)
+    if config is None:
+        return 0
+    recorded_missions = (source.load_config(user) or {}).get(MISSIONS_WORKED_TOGETHER)
+
+    replay_storage = ReplayStorage(output)
+    replay_storage.save_config(user, config)
+    session = InteractionAPI(user, user_storage=replay_storage)
+    for weight in ("conformance_time_weight", "conformance_response_weight"):
+        if settings.get(weight) is not None:
+            setattr(session.user_predictor, weight, settings[weight])
+
+    previous, count = None, 0
+    for row in source.iter_history(user):
+        if previous is not None and mission_ends(previous, row):
+            session.update_kinship()
+        previous = row
+        session.calculate_trust(role=row["role"], expected_time_for_task=row["expected time"],
+                                actual_response_list=row["actual response time"] or [],
+                                sub_task_status=row["goalstatus"], actual_time_for_task=row["actual time"],
+                                goal=row["Task"] or "")
+        count += 1
+    if previous.get("mission") is not None and recorded_missions is not None \
+            and recorded_missions > previous["mission"]:
+        session.update_kinship()
+    session.flush()
+    output.save_config(user, replay_storage.load_config(user))
+    return count
+
+
+def _replay_worker(user: str, source_path: str, output_dir: str, settings: dict):
+    return user, replay_user(user, open_storage(source_path), FileStorage(output_dir), settings)
+
+
+def replay_fleet(source_path: str, output_dir: str, users: list = None, settings: dict = None,
+                 processes: int = None):
+    """
+    Replays many users, each in a worker process
+    @param source_path: config folder or sqlite database with the recorded histories
+    @param output_dir: folder receiving one replayed history and configuration per user
+    @param users: users to replay, every user of the source if not given
+    @param processes: number of worker processes, one per core if not given
+    @return: dict of user to number of subtasks replayed
+    """
+    if users is None:
+        users = open_storage(source_path).list_users()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_replay_worker, user, source_path, output_dir, settings) for user in users]
+        return dict(future.result() for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded subtask histories with different settings")
+    parser.add_argument("users", nargs="*", help="users to replay, all users of the source if not given")
+    parser.add_argument("--source", default=os.path.join(os.path.dirname(__file__), "config"),
+                        help="config folder or sqlite .db file holding the recorded histories")
+    parser.add_argument("--output", required=True, help="folder receiving the replayed histories")
+    parser.add_argument("--processes", type=int, default=None)
+    for setting in SETTINGS:
+        parser.add_argument("--" + setting.replace("_", "-"), type=float, default=None)
+    args = parser.parse_args()
+    settings = {setting: getattr(args, setting) for setting in SETTINGS}
+    replayed = replay_fleet(args.source, args.output, args.users or None, settings, args.processes)
+    print("Replayed", sum(replayed.values()), "subtasks of", len(replayed), "users into", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Process wide registry of live InteractionAPI sessions
+One session per user is kept in memory and handed out on every request,
+so the configuration of a hot user is parsed once and not on every call
+Least recently used sessions are flushed and dropped once the registry is full, the statistics of an
+unfinished mission are saved with the configuration and the next session of the user continues the mission
+"""
+import threading
+from collections import OrderedDict
+from human_interaction import InteractionAPI
+
+
+class SessionRegistry(object):
+
+    def __init__(self, capacity: int = 128, **session_options):
+        """
+        @param capacity: maximum number of live sessions
+        @param session_options: keyword arguments passed to InteractionAPI when a session is created
+        """
+        if capacity < 1:
+            raise Exception("Capacity must be at least 1")
+        self.capacity = capacity
+        self.session_options = session_options
+        self.sessions = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Callables called with the user whenever a session is dropped
+        self.evict_listeners = []
+
+    def add_evict_listener(self, listener):
+        """
+        Registers a callable(user) called after the session of a user is dropped, under the registry lock
+        """
+        self.evict_listeners.append(listener)
+
+    def dropped(self, user: str):
+        for listener in list(self.evict_listeners):
+            listener(user)
+
+    def get(self, user: str):
+        """
+        Returns the live session of the user, creating it if needed
+        @param user: username
+        @return: InteractionAPI
+        """
+        with self.lock:
+            session = self.sessions.get(user)
+            if session is not None:
+                self.hits += 1
+                self.sessions.move_to_end(user)
+                return session
+            self.misses += 1
+            session = InteractionAPI(user, **self.session_options)
+            session.resume_mission()
+            self.sessions[user] = session
+            while len(self.sessions) > self.capacity:
+                evicted_user, evicted = self.sessions.popitem(last=False)
+                evicted.suspend_mission()
+                self.evictions += 1
+                self.dropped(evicted_user)
+            return session
+
+    def evict(self, user: str):
+        """
+        Flushes and drops the session of the user if it is live
+        """
+        with self.lock:
+            session = self.sessions.pop(user, None)
+            if session is not None:
+                session.suspend_mission()
+                self.evictions += 1
+                self.dropped(user)
+
+    def flush_all(self):
+        """
+        Flushes every live session, sessions stay in the registry
+        """
+        with self.lock:
+            for session in self.sessions.values():
+                session.flush()
+
+    def clear(self):
+        """
+        Flushes and drops every live session
+        """
+        with self.lock:
+            for session in self.sessions.values():
+                session.suspend_mission()
+            users = list(self.sessions)
+            self.sessions.clear()
+            for user in users:
+                self.dropped(user)
+
+    def stats(self):
+        """
+        @return: dict of live session count, capacity, hits, misses and evictions
+        """
+        with self.lock:
+            return {"sessions": len(self.sessions), "capacity": self.capacity,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __contains__(self, user):
+        return user in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+default_registry = SessionRegistry()
+
+
+def get_session(user: str):
+    """
+    Returns the live session of the user from the default registry
+    @return: InteractionAPI
+    """
+    return default_registry.get(user)
@@ -0,0 +1,254 @@
+"""
+Trust vectors of many users in shared memory, so decision loops in other processes read
+fetch_probability_value at memory speed without locks or reading configurations
+The table is a multiprocessing.shared_memory block of fixed size slots, a user is placed by the crc32
+of its name with linear probing. Every slot carries a sequence number written odd before and even
+after an update, readers retry while it is odd or changed during their read, so they never block
+and never see half an update. Writers of different processes are serialized by a lock file
+trust_service.py and ingest.py publish every update they apply when started with --trust-table
+    python shared_trust.py publish --source config
+    python shared_trust.py read user19
+"""
+import argparse
+import os
+import struct
+import tempfile
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+import config_manager
+from locks import user_lock
+from storage import DEFAULT_CONFIG_DIR, open_storage
+from trust import probability_value
+from utils import *
+
+DEFAULT_NAME = "trust_table"
+DEFAULT_SLOTS = 1 << 16
+MAGIC = b"TRUSTTBL"
+# magic, number of slots
+HEADER = struct.Struct("<8sQ")
+# sequence number, name length, name, trust, distrust, uncertainty
+SLOT = struct.Struct("<QI4x64sddd")
+SEQUENCE = struct.Struct("<Q")
+VALUES = struct.Struct("<ddd")
+NAME_SIZE = 64
+VALUES_OFFSET = 8 + 4 + 4 + NAME_SIZE
+# Reads retried before the reader yields its time slice to a writer that was preempted mid update
+READ_SPINS = 100
+# Seconds a slot may stay mid update before the writer is taken to have died
+READ_TIMEOUT = 1.0
+
+
+def open_table(name: str = DEFAULT_NAME, slots: int = DEFAULT_SLOTS):
+    """
+    Opens the table, creating it with the given number of slots if there is none
+    @return: SharedTrustTable
+    """
+    try:
+        return SharedTrustTable(name)
+    except FileNotFoundError:
+        pass
+    try:
+        return SharedTrustTable(name, slots, create=True)
+    except FileExistsError:
+        # Another process created it in the meantime
+        return SharedTrustTable(name)
+
+
+class SharedTrustTable(object):
+
+    def __init__(self, name: str = DEFAULT_NAME, slots: int = DEFAULT_SLOTS, create: bool = False):
+        """
+        Opens the table, creating it if asked
+        @param name: name of the shared memory block
+        @param slots: capacity of a created table, the table is full once every slot holds a user
+        @param create: create a new table instead of opening an existing one
+        """
+        self.name = name
+        if create:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=HEADER.size + slots * SLOT.size)
+            HEADER.pack_into(self.memory.buf, 0, MAGIC, slots)
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+            magic, slots = HEADER.unpack_from(self.memory.buf, 0)
+            if magic != MAGIC:
+                self.memory.close()
+                raise Exception(name + " is not a trust table")
+        # The table outlives this process until unlink is called, not only until the process ends
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self.slots = slots
+        self.buffer = self.memory.buf
+        self.write_lock = user_lock("shared_trust:" + name, os.path.join(tempfile.gettempdir(), name + ".lock"))
+        self.positions = {}
+        self.listener = None
+        self.storage = None
+
+    @staticmethod
+    def encode(user: str):
+        key = user.encode("utf-8")
+        if len(key) > NAME_SIZE:
+            raise Exception("User names longer than %d bytes cannot be kept in the trust table" % NAME_SIZE)
+        return key
+
+    def _offset(self, slot: int):
+        return HEADER.size + slot * SLOT.size
+
+    def _find(self, key: bytes, claim: bool = False):
+        """
+        @return: offset of the slot of the user, None if the user has no slot and claim is not set
+        """
+        slot = zlib.crc32(key) % self.slots
+        for _ in range(self.slots):
+            offset = self._offset(slot)
+            length = struct.unpack_from("<I", self.buffer, offset + 8)[0]
+            if length == 0:
+                if not claim:
+                    return None
+                # Claimed under the write lock, readers see the name once the sequence is even again
+                sequence = SEQUENCE.unpack_from(self.buffer, offset)[0]
+                SEQUENCE.pack_into(self.buffer, offset, sequence + 1)
+                struct.pack_into("<I4x64s", self.buffer, offset + 8, len(key), key)
+                VALUES.pack_into(self.buffer, offset + VALUES_OFFSET, 0.0, 0.0, 0.0)
+                SEQUENCE.pack_into(self.buffer, offset, sequence + 2)
+                return offset
+            if length == len(key) and bytes(self.buffer[offset + 16:offset + 16 + length]) == key:
+                return offset
+            slot = (slot + 1) % self.slots
+        if claim:
+            raise Exception("Trust table %s is full" % self.name)
+        return None
+
+    def write(self, user: str, trust: float, distrust: float, uncertainty: float):
+        """
+        Publishes the trust vector of a user
+        """
+        key = self.encode(user)
+        with self.write_lock:
+            offset = self.positions.get(user)
+            if offset is None:
+                offset = self.positions[user] = self._find(key, claim=True)
+            sequence = SEQUENCE.unpack_from(self.buffer, offset)[0] | 1
+            SEQUENCE.pack_into(self.buffer, offset, sequence)
+            VALUES.pack_into(self.buffer, offset + VALUES_OFFSET, trust, distrust, uncertainty)
+            SEQUENCE.pack_into(self.buffer, offset, sequence + 1)
+
+    def read(self, user: str):
+        """
+        Reads the trust vector of a user without taking any lock
+        @return: trust, distrust, uncertainty, None if the user is not in the table
+        """
+        offset = self.positions.get(user)
+        if offset is None:
+            offset = self._find(self.encode(user))
+            if offset is None:
+                return None
+            # Slots are never freed, the position of a user stays valid
+            self.positions[user] = offset
+        deadline = None
+        while True:
+            for _ in range(READ_SPINS):
+                before = SEQUENCE.unpack_from(self.buffer, offset)[0]
+                if before & 1:
+                    continue
+                values = VALUES.unpack_from(self.buffer, offset + VALUES_OFFSET)
+                if SEQUENCE.unpack_from(self.buffer, offset)[0] == before:
+                    return values
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise Exception("Trust of %s stayed mid update while it was read" % user)
+            time.sleep(0)
+
+    def probability(self, user: str):
+        """
+        Same value as InteractionAPI.fetch_probability_value of the user
+        @return: probability, None if the user is not in the table
+        """
+        values = self.read(user)
+        if values is None:
+            return None
+        return probability_value(*values)
+
+    def users(self):
+        """
+        @return: sorted list of the users in the table
+        """
+        users = []
+        for slot in range(self.slots):
+            offset = self._offset(slot)
+            length = struct.unpack_from("<I", self.buffer, offset + 8)[0]
+            if length:
+                users.append(bytes(self.buffer[offset + 16:offset + 16 + length]).decode("utf-8"))
+        return sorted(users)
+
+    def publish(self, source):
+        """
+        Writes the trust vector of every user of a storage
+        @return: number of users written
+        """
+        users = source.list_users()
+        for user in users:
+            config = source.load_config(user) or {}
+            self.write(user, config.get(TRUST, 0), config.get(DISTRUST, 0), config.get(UNCERTAINTY, 0))
+        return len(users)
+
+    def attach(self, user_storage=None):
+        """
+        Publishes every trust vector this process updates, as soon as it is updated in memory
+        @param user_storage: only publish users of this storage, every storage if not given
+        """
+        self.detach()
+        self.storage = user_storage
+
+        def listener(user, updated_storage, config):
+            if self.storage is None or updated_storage is self.storage:
+                self.write(user, config[TRUST], config[DISTRUST], config[UNCERTAINTY])
+        self.listener = listener
+        config_manager.add_update_listener(listener)
+
+    def detach(self):
+        if self.listener is not None:
+            config_manager.remove_update_listener(self.listener)
+            self.listener = None
+
+    def close(self):
+        self.detach()
+        self.buffer = None
+        self.memory.close()
+
+    def unlink(self):
+        """
+        Removes the table, processes having it open keep their mapping
+        """
+        self.close()
+        resource_tracker.register(self.memory._name, "shared_memory")
+        self.memory.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trust vectors of every user in shared memory")
+    parser.add_argument("--name", default=DEFAULT_NAME, help="name of the shared memory block")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    publish_parser = subparsers.add_parser("publish", help="create the table if needed and write every user")
+    publish_parser.add_argument("--source", default=DEFAULT_CONFIG_DIR,
+                                help="config folder or sqlite .db file holding the configurations")
+    publish_parser.add_argument("--slots", type=int, default=DEFAULT_SLOTS)
+    read_parser = subparsers.add_parser("read", help="print trust vector and probability of users")
+    read_parser.add_argument("users", nargs="*", help="users to read, every user of the table if not given")
+    subparsers.add_parser("unlink", help="remove the table")
+    args = parser.parse_args()
+    if args.command == "publish":
+        table = open_table(args.name, args.slots)
+        print("Published", table.publish(open_storage(args.source)), "users to", args.name)
+        table.close()
+    elif args.command == "read":
+        table = SharedTrustTable(args.name)
+        for user in args.users or table.users():
+            print(user, table.read(user), table.probability(user))
+        table.close()
+    else:
+        SharedTrustTable(args.name).unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Monte Carlo simulation of trust dynamics with synthetic operators
+Each operator gets a profile drawn from a population: role mix, goal success rate, pace against the
+expected time of a subtask, response times and attitude. Its missions are generated from the profile
+and driven through InteractionAPI, so through Predictors and Trust, on an in memory storage
+Operators are simulated in a process pool. Every operator has its own random stream spawned from
+one numpy SeedSequence by operator index, results do not depend on the number of processes
+    python simulation.py --operators 1000 --missions 20 --processes 4 --seed 7
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config_manager import default_config
+from human_interaction import InteractionAPI
+from storage import MemoryStorage
+from utils import *
+
+# Quantities summarized over the operators
+OUTCOMES = ("trust", "distrust", "uncertainty", "probability", "kinship", "positive_share")
+
+
+class OperatorProfile(object):
+
+    __slots__ = ("role_mix", "success_rate", "pace", "response_time", "responses_per_subtask", "attitude")
+
+    def __init__(self, role_mix: list, success_rate: float, pace: float, response_time: float,
+                 responses_per_subtask: float, attitude: float):
+        """
+        @param role_mix: probability of the roles 1, 2 and 3
+        @param success_rate: probability that the goal of a subtask is reached
+        @param pace: median ratio of actual to expected time of a subtask
+        @param response_time: median response time in minutes
+        @param responses_per_subtask: mean number of interactions per subtask
+        @param attitude: attitude value of the operator configuration
+        """
+        self.role_mix = role_mix
+        self.success_rate = success_rate
+        self.pace = pace
+        self.response_time = response_time
+        self.responses_per_subtask = responses_per_subtask
+        self.attitude = attitude
+
+    @classmethod
+    def draw(cls, rng):
+        """
+        Draws a profile from the synthetic population
+        @param rng: numpy Generator
+        """
+        return cls(role_mix=rng.dirichlet([2.0, 2.0, 1.0]).tolist(),
+                   success_rate=float(rng.beta(6.0, 2.0)),
+                   pace=float(rng.lognormal(0.0, 0.3)),
+                   response_time=float(rng.lognormal(math.log(1.5), 0.5)),
+                   responses_per_subtask=float(rng.uniform(0.5, 4.0)),
+                   attitude=float(rng.random() < 0.8))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def draw_subtask(profile: OperatorProfile, rng):
+    """
+    @return: dict of calculate_trust arguments of one subtask of the operator
+    """
+    expected_time = float(rng.uniform(5.0, 20.0))
+    responses = rng.lognormal(math.log(profile.response_time), 0.5, rng.poisson(profile.responses_per_subtask))
+    return {"role": int(rng.choice(3, p=profile.role_mix)) + 1,
+            "expected_time_for_task": expected_time,
+            "actual_response_list": [float(value) for value in responses],
+            "sub_task_status": int(rng.random() < profile.success_rate),
+            "actual_time_for_task": float(expected_time * rng.lognormal(math.log(profile.pace), 0.25))}
+
+
+def simulate_operator(index: int, seed_sequence, missions: int, subtasks_per_mission: int):
+    """
+    Draws the profile and missions of one operator and runs them through the trust pipeline
+    @param index: operator number, used as user name
+    @param seed_sequence: numpy SeedSequence of the operator
+    @param missions: missions worked together
+    @param subtasks_per_mission: mean subtasks of a mission, at least one
+    @return: dict of the profile, final trust state and counts of the operator
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed_sequence)
+    profile = OperatorProfile.draw(rng)
+    user = "operator%d" % index
+    # The operator starts from a new user configuration with the attitude of its profile
+    user_storage = MemoryStorage()
+    config = default_config()
+    config[ATTITUDE] = profile.attitude
+    user_storage.save_config(user, config)
+    session = InteractionAPI(user, user_storage=user_storage)
+    subtasks = 0
+    for _ in range(missions):
+        records = [draw_subtask(profile, rng) for _ in range(1 + rng.poisson(max(0, subtasks_per_mission - 1)))]
+        session.calculate_trust_batch(records)
+        session.update_kinship()
+        subtasks += len(records)
+    config = session.user_predictor.config
+    positive, negative = config[POSITIVE_EXP_COUNT], config[NEGATIVE_EXP_COUNT]
+    return {"operator": index, "profile": profile.as_dict(), "subtasks": subtasks, "missions": missions,
+            "positive": positive, "negative": negative, "positive_share": positive / (positive + negative),
+            "trust": config[TRUST], "distrust": config[DISTRUST], "uncertainty": config[UNCERTAINTY],
+            "kinship": config[KINSHIP], "probability": session.fetch_probability_value()}
+
+
+def _simulate_chunk(indices: list, seed_sequences: list, missions: int, subtasks_per_mission: int):
+    # Predictors and Trust log every step at debug and info level, kept quiet in the workers
+    logging.getLogger("predictors").setLevel(logging.WARNING)
+    logging.getLogger("trust").setLevel(logging.WARNING)
+    start = time.perf_counter()
+    results = [simulate_operator(index, seed_sequence, missions, subtasks_per_mission)
+               for index, seed_sequence in zip(indices, seed_sequences)]
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list):
+    """
+    @return: dict of outcome to count, mean, std, min, max and the 5, 25, 50, 75 and 95 percentiles
+    """
+    import numpy as np
+    summary = {}
+    for outcome in OUTCOMES:
+        values = np.array([result[outcome] for result in results if result[outcome] is not None], dtype=float)
+        if not values.size:
+            continue
+        percentiles = np.percentile(values, [5, 25, 50, 75, 95])
+        summary[outcome] = {"count": int(values.size), "mean": float(values.mean()), "std": float(values.std()),
+                            "min": float(values.min()), "max": float(values.max()),
+                            "percentiles": dict(zip(("p5", "p25", "p50", "p75", "p95"),
+                                                    (float(value) for value in percentiles)))}
+    summary["distrusted_share"] = sum(1 for result in results if result["distrust"] > result["trust"]) / max(
+        1, len(results))
+    return summary
+
+
+def run_simulation(operators: int = 100, missions: int = 10, subtasks_per_mission: int = 8, seed: int = 0,
+                   processes: int = None, chunk_size: int = None):
+    """
+    Simulates operators in a process pool
+    @param operators: number of synthetic operators
+    @param missions: missions per operator
+    @param subtasks_per_mission: mean subtasks per mission
+    @param seed: root seed, the same seed gives the same results for any number of processes
+    @param processes: worker processes, one per core if not given
+    @param chunk_size: operators per task sent to a worker, about four tasks per worker if not given
+    @return: dict with "operators" results, "summary" of the outcomes and "throughput"
+    """
+    import numpy as np
+    seed_sequences = np.random.SeedSequence(seed).spawn(operators)
+    processes = processes or os.cpu_count() or 1
+    chunk_size = chunk_size or max(1, math.ceil(operators / (processes * 4)))
+    start = time.perf_counter()
+    results, busy = [], 0.0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_simulate_chunk, list(range(first, min(operators, first + chunk_size))),
+                                   seed_sequences[first:first + chunk_size], missions, subtasks_per_mission)
+                   for first in range(0, operators, chunk_size)]
+        for future in futures:
+            chunk_results, chunk_seconds = future.result()
+            results.extend(chunk_results)
+            busy += chunk_seconds
+    wall = time.perf_counter() - start
+    subtasks = sum(result["subtasks"] for result in results)
+    throughput = {"wall_seconds": wall, "worker_seconds": busy, "processes": processes, "operators": operators,
+                  "missions": operators * missions, "subtasks": subtasks,
+                  "subtasks_per_second": subtasks / wall if wall else 0.0,
+                  "missions_per_second": operators * missions / wall if wall else 0.0}
+    return {"operators": results, "summary": summarize(results), "throughput": throughput}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate trust dynamics of synthetic operators")
+    parser.add_argument("--operators", type=int, default=100)
+    parser.add_argument("--missions", type=int, default=10, help="missions per operator")
+    parser.add_argument("--subtasks", type=int, default=8, help="mean subtasks per mission")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", help="json file receiving the per operator results and the summary")
+    args = parser.parse_args()
+    simulation = run_simulation(args.operators, args.missions, args.subtasks, args.seed, args.processes)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(simulation, outfile, indent=4)
+    for outcome, values in simulation["summary"].items():
+        if isinstance(values, dict):
+            print("%-15s mean %.3f std %.3f p5 %.3f p50 %.3f p95 %.3f" % (
+                outcome, values["mean"], values["std"], values["percentiles"]["p5"], values["percentiles"]["p50"],
+                values["percentiles"]["p95"]))
+    print("distrusted share %.3f" % simulation["summary"]["distrusted_share"])
+    throughput = simulation["throughput"]
+    print("%d subtasks of %d missions in %.2f s, %.0f subtasks/s with %d processes" % (
+        throughput["subtasks"], throughput["missions"], throughput["wall_seconds"],
+        throughput["subtasks_per_second"], throughput["processes"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Storage backends for user configuration and subtask history
+FileStorage keeps the original layout, one <user>.yaml and one <user>api21less.csv per user in a folder
+SQLiteStorage keeps every user in one database file
+Both return history rows as dict of column name to parsed value
+"""
+import ast
+import csv
+import glob
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+import yaml
+from locks import user_lock
+DIR_NAME = os.path.dirname(__file__)
+DEFAULT_CONFIG_DIR = os.path.join(DIR_NAME, "config")
+HISTORY_SUFFIX = "api21less.csv"
+# User names become file names, only letters, digits, underscore, dot and dash are allowed
+USER_NAME = re.compile(r"[\w.-]+")
+
+
+def atomic_write(path: str, text: str):
+    """
+    Writes text to a temporary file in the same folder and renames it over path,
+    so a crash leaves either the old or the new content but never a truncated file
+    """
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "w") as outfile:
+        outfile.write(text)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, path)
+
+
+def valid_user_name(user):
+    """
+    @return: True when user can name the files of a user inside the storage folder
+    """
+    return isinstance(user, str) and USER_NAME.fullmatch(user) is not None and ".." not in user
+
+
+def parse_value(value: str):
+    """
+    Converts a value read from a csv back to a python value
+    Empty strings are None, numbers and lists are parsed, anything else stays a string
+    """
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if value.startswith("["):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+    return value
+
+
+class Storage(object):
+    """
+    Interface of a storage backend
+    """
+
+    def load_config(self, user: str):
+        """
+        @return: configuration dict of the user, None if the user has no configuration yet
+        """
+        raise NotImplementedError
+
+    def save_config(self, user: str, config: dict):
+        """
+        Replaces the configuration of the user
+        """
+        raise NotImplementedError
+
+    def create_history(self, user: str, columns: list):
+        """
+        Creates an empty history for the user if there is none
+        """
+        raise NotImplementedError
+
+    def append_history(self, user: str, columns: list, rows: list):
+        """
+        Adds rows at the end of the history of the user
+        @param rows: list of rows, each a list of values in the order of the columns
+        """
+        raise NotImplementedError
+
+    def iter_history(self, user: str):
+        """
+        Streams the history of the user
+        @return: iterator of dict, column name to value
+        """
+        raise NotImplementedError
+
+    def list_users(self):
+        """
+        @return: sorted list of the users having a configuration
+        """
+        raise NotImplementedError
+
+    def lock_path(self, user: str):
+        """
+        @return: lock file other processes use for the user, None if the backend is private to this process
+        """
+        return None
+
+    def lock(self, user: str):
+        """
+        @return: UserLock held around read, modify and write of the user state
+        """
+        path = self.lock_path(user)
+        return user_lock(path or "%d:%s" % (id(self), user), path)
+
+    def journal_path(self, user: str):
+        """
+        @return: file of the write ahead journal of the user, None if the backend keeps no journal
+        """
+        return None
+
+    def sync(self, user: str):
+        """
+        Makes the configuration and history written so far durable
+        """
+        pass
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups several updates so they are committed together, where the backend supports it
+        """
+        yield self
+
+
+class FileStorage(Storage):
+
+    def __init__(self, config_dir: str = DEFAULT_CONFIG_DIR):
+        """
+        @param config_dir: folder holding the yaml configurations and csv histories
+        """
+        self.config_dir = config_dir
+
+    def config_path(self, user: str):
+        return os.path.join(self.config_dir, user + ".yaml")
+
+    def history_path(self, user: str):
+        return os.path.join(self.config_dir, user + HISTORY_SUFFIX)
+
+    def lock_path(self, user: str):
+        return os.path.join(os.path.abspath(self.config_dir), user + ".lock")
+
+    def journal_path(self, user: str):
+        return os.path.join(self.config_dir, user + ".journal")
+
+    def sync(self, user: str):
+        # Configurations are written with atomic_write, only the appended history needs a sync
+        if os.path.isfile(self.history_path(user)):
+            with open(self.history_path(user), "rb") as infile:
+                os.fsync(infile.fileno())
+
+    def load_config(self, user: str):
+        if not os.path.isfile(self.config_path(user)):
+            return None
+        with open(self.config_path(user), "r") as infile:
+            return yaml.safe_load(infile)
+
+    def save_config(self, user: str, config: dict):
+        if not os.path.isdir(self.config_dir):
+            os.makedirs(self.config_dir)
+        atomic_write(self.config_path(user), yaml.dump(config, indent=4))
+
+    def create_history(self, user: str, columns: list):
+        if os.path.isfile(self.history_path(user)):
+            self.upgrade_history(user, columns)
+            return
+        if not os.path.isdir(self.config_dir):
+            os.makedirs(self.config_dir)
+        with open(self.history_path(user), "w", newline="") as outfile:
+            csv.writer(outfile).writerow(columns)
+
+    def upgrade_history(self, user: str, columns: list):
+        """
+        Adds the columns missing from a history written by an older version, older rows keep them empty
+        Only a header that is the beginning of columns is upgraded, any other header is left as it is
+        """
+        with open(self.history_path(user), "r", newline="") as infile:
+            header = next(csv.reader(infile), [])
+        if len(header) >= len(columns) or header != columns[:len(header)]:
+            return
+        with self.lock(user):
+            temp_path = "%s.%d.tmp" % (self.history_path(user), os.getpid())
+            with open(self.history_path(user), "r", newline="") as infile, \
+                    open(temp_path, "w", newline="") as outfile:
+                reader, writer = csv.reader(infile), csv.writer(outfile)
+                header = next(reader, [])
+                if len(header) >= len(columns):
+                    # Another process upgraded the history in the meantime
+                    os.remove(temp_path)
+                    return
+                writer.writerow(columns)
+                for row in reader:
+                    writer.writerow(row + [""] * (len(columns) - len(row)))
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(temp_path, self.history_path(user))
+
+    def append_history(self, user: str, columns: list, rows: list):
+        if not os.path.isfile(self.history_path(user)):
+            self.create_history(user, columns)
+        with open(self.history_path(user), "a", newline="") as outfile:
+            csv.writer(outfile).writerows(rows)
+
+    def iter_history(self, user: str):
+        if not os.path.isfile(self.history_path(user)):
+            return
+        with open(self.history_path(user), "r", newline="") as infile:
+            for row in csv.DictReader(infile):
+                yield {key: parse_value(value) for key, value in row.items()}
+
+    def list_users(self):
+        paths = glob.glob(os.path.join(glob.escape(self.config_dir), "*.yaml"))
+        return sorted(os.path.basename(path)[:-len(".yaml")] for path in paths)
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps configurations and histories in this process only, for replays and simulations
+    """
+
+    def __init__(self):
+        self.configs = {}
+        self.histories = {}
+
+    def load_config(self, user: str):
+        config = self.configs.get(user)
+        return dict(config) if config is not None else None
+
+    def save_config(self, user: str, config: dict):
+        self.configs[user] = dict(config)
+
+    def create_history(self, user: str, columns: list):
+        self.histories.setdefault(user, [])
+
+    def append_history(self, user: str, columns: list, rows: list):
+        self.histories.setdefault(user, []).extend(dict(zip(columns, row)) for row in rows)
+
+    def iter_history(self, user: str):
+        return iter(list(self.histories.get(user, [])))
+
+    def list_users(self):
+        return sorted(self.configs)
+
+
+class SQLiteStorage(Storage):
+
+    def __init__(self, db_path: str = os.path.join(DEFAULT_CONFIG_DIR, "trust.db")):
+        """
+        Opens the database in WAL mode so readers do not block the writer
+        @param db_path: sqlite database file
+        """
+        import sqlite3
+        self.db_path = db_path
+        if os.path.dirname(db_path) and not os.path.isdir(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        self.connection_lock = threading.RLock()
+        self.batch_depth = 0
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS users (user TEXT PRIMARY KEY, config TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS history ("
+                                "id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, row TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS history_user ON history (user, id)")
+
+    def lock_path(self, user: str):
+        return os.path.join(os.path.abspath(self.db_path) + ".locks", user + ".lock")
+
+    def journal_path(self, user: str):
+        return os.path.join(os.path.abspath(self.db_path) + ".locks", user + ".journal")
+
+    def sync(self, user: str):
+        with self.connection_lock:
+            self.connection.execute("PRAGMA wal_checkpoint(FULL)")
+
+    @contextmanager
+    def transaction(self):
+        with self.connection_lock:
+            if self.batch_depth == 0:
+                self.connection.execute("BEGIN")
+            self.batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.connection.execute("COMMIT")
+
+    def load_config(self, user: str):
+        with self.connection_lock:
+            row = self.connection.execute("SELECT config FROM users WHERE user = ?", (user,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_config(self, user: str, config: dict):
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO users (user, config) VALUES (?, ?)",
+                                    (user, json.dumps(config)))
+
+    def create_history(self, user: str, columns: list):
+        # Rows carry their column names, there is nothing to create per user
+        pass
+
+    def append_history(self, user: str, columns: list, rows: list):
+        with self.transaction():
+            self.connection.executemany("INSERT INTO history (user, row) VALUES (?, ?)",
+                                        [(user, json.dumps(dict(zip(columns, row)))) for row in rows])
+
+    def iter_history(self, user: str, batch_size: int = 1000):
+        last_id = 0
+        while True:
+            with self.connection_lock:
+                rows = self.connection.execute("SELECT id, row FROM history WHERE user = ? AND id > ? "
+                                               "ORDER BY id LIMIT ?", (user, last_id, batch_size)).fetchall()
+            for row_id, row in rows:
+                yield json.loads(row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def list_users(self):
+        with self.connection_lock:
+            return [row[0] for row in self.connection.execute("SELECT user FROM users ORDER BY user")]
+
+    def close(self):
+        with self.connection_lock:
+            self.connection.close()
+
+
+default_storage = FileStorage()
+
+
+def open_storage(path: str):
+    """
+    Opens a sqlite database for a .db path, a folder of yaml and csv files otherwise
+    @return: Storage
+    """
+    if path.endswith(".db"):
+        return SQLiteStorage(path)
+    return FileStorage(path)
+
+
+def migrate(source: Storage, target: Storage, batch_size: int = 1000):
+    """
+    Copies the configuration and history of every user from source to target
+    Each user is copied in its own transaction, history in batches of batch_size rows.
+    Users the target already has are skipped, copying them again would append their history twice
+    @return: number of users copied
+    """
+    copied = 0
+    for user in source.list_users():
+        if target.load_config(user) is not None:
+            continue
+        copied += 1
+        with target.transaction():
+            target.save_config(user, source.load_config(user))
+            columns, rows = None, []
+            for row in source.iter_history(user):
+                columns = columns or list(row.keys())
+                rows.append([row.get(column) for column in columns])
+                if len(rows) >= batch_size:
+                    target.append_history(user, columns, rows)
+                    rows = []
+            if rows:
+                target.append_history(user, columns, rows)
+    return copied
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Import a config folder of yaml and csv files into sqlite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="copy every user of a config folder into a database")
+    migrate_parser.add_argument("--config-dir", default=DEFAULT_CONFIG_DIR, help="folder of yaml and csv files")
+    migrate_parser.add_argument("--db", default=os.path.join(DEFAULT_CONFIG_DIR, "trust.db"),
+                                help="sqlite database to import into")
+    args = parser.parse_args()
+    target = SQLiteStorage(args.db)
+    count = migrate(FileStorage(args.config_dir), target)
+    target.close()
+    print("Migrated", count, "users from", args.config_dir, "to", args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+What-if sweeps of the predictor settings over the recorded subtasks of a user
+Every point of a grid of predictor threshold, attitude, initial kinship and conformance weights is
+evaluated at once with numpy: experience types, experience counts, kinship after each mission,
+trust vectors and the probability fetch_probability_value would give
+The subtasks are taken as replay.py takes them, from the state before the first recorded subtask,
+with the mission boundaries replay.mission_ends finds and the final mission ended when the recorded
+configuration counts it. Reliability does not depend on the settings and is read from the history
+    python sweep.py user19 --predictor-threshold 0.4 0.5 0.6 --attitude 0 1
+"""
+import argparse
+import itertools
+import os
+from predictors import dev_response_time, dev_time_to_goal
+from replay import initial_config, mission_ends
+from storage import open_storage
+from trust import _round_batch, probability_values, update_trust_vectors
+from utils import *
+
+# Swept settings, in the order of the grid columns
+PARAMETERS = ("predictor_threshold", "attitude", "initial_kinship", "conformance_time_weight",
+              "conformance_response_weight")
+ROLE_KNOWLEDGE = {1: 0.33, 2: 0.66, 3: 1}
+# Grid points evaluated together, bounds the memory used by the grid times subtasks arrays
+CHUNK_ELEMENTS = 1 << 22
+
+
+def make_grid(**values):
+    """
+    @param values: list of values of each of PARAMETERS
+    @return: dict of parameter to array, one element per combination of the values
+    """
+    import numpy as np
+    combinations = list(itertools.product(*(values[parameter] for parameter in PARAMETERS)))
+    columns = np.array(combinations, dtype=float).reshape(len(combinations), len(PARAMETERS))
+    return {parameter: columns[:, i] for i, parameter in enumerate(PARAMETERS)}
+
+
+class RecordedSubtasks(object):
+    """
+    Inputs of the trust pipeline that do not depend on the swept settings, one array element per subtask
+    """
+
+    def __init__(self, rows: list, response_time: float, recorded_missions: int = None):
+        """
+        @param rows: recorded history rows, dict of column name to value
+        @param response_time: expected response time of the user
+        @param recorded_missions: missions worked together in the recorded configuration, tells whether
+            the mission of the last subtask was ended
+        """
+        import numpy as np
+        self.knowledge = np.array([ROLE_KNOWLEDGE[row["role"]] for row in rows], dtype=float)
+        self.status = np.array([row["goalstatus"] for row in rows], dtype=float)
+        self.reliability = np.array([row["reliability"] for row in rows], dtype=float)
+        self.time_deviation = np.array([dev_time_to_goal(row["actual time"], row["expected time"])
+                                        for row in rows], dtype=float)
+        self.response_deviation = np.array([dev_response_time(row["actual response time"] or [], response_time)
+                                            for row in rows], dtype=float)
+        self.mission_starts = [0] + [i for i in range(1, len(rows)) if mission_ends(rows[i - 1], rows[i])]
+        self.final_mission_ended = bool(rows) and rows[-1].get("mission") is not None \
+            and recorded_missions is not None and recorded_missions > rows[-1]["mission"]
+
+    def __len__(self):
+        return self.status.size
+
+
+def sweep_subtasks(subtasks: RecordedSubtasks, config: dict, grid: dict, trajectories: bool = False):
+    """
+    Runs the recorded subtasks through the trust pipeline for every grid point
+    @param subtasks: recorded subtasks
+    @param config: configuration before the first subtask, see replay.initial_config
+    @param grid: dict of parameter to array of grid point values, see make_grid
+    @param trajectories: also return the per subtask arrays, grid points by subtasks
+    @return: dict of name to array: final "positive", "negative", "trust", "distrust", "uncertainty",
+        "kinship", "missions" and "probability" per grid point, and with trajectories
+        "predictor_value", "positive_steps", "negative_steps", "trust_steps", "distrust_steps",
+        "uncertainty_steps" and "probability_steps"
+    """
+    import numpy as np
+    threshold = grid["predictor_threshold"][:, None]
+    attitude = grid["attitude"][:, None]
+    points = threshold.shape[0]
+
+    competency = (subtasks.knowledge + subtasks.status + attitude) / 3
+    conformance = (grid["conformance_time_weight"][:, None] * subtasks.time_deviation +
+                   grid["conformance_response_weight"][:, None] * subtasks.response_deviation)
+    predictor_value = ((competency + subtasks.reliability) / 6) + (2 * conformance / 3)
+    positive = threshold <= predictor_value
+    deviation = np.where(positive, 1.0, np.maximum(0, predictor_value - (np.abs(predictor_value - threshold) /
+                                                                           threshold)))
+    positive_counts = config[POSITIVE_EXP_COUNT] + np.cumsum(positive, axis=1)
+    negative_counts = config[NEGATIVE_EXP_COUNT] + np.cumsum(~positive, axis=1)
+
+    # Kinship changes once per mission, it is kept in the configuration rounded to two digits
+    kinship = np.array(grid["initial_kinship"], dtype=float)
+    missions = np.full(points, config[MISSIONS_WORKED_TOGETHER], dtype=float)
+    kinships = np.empty(predictor_value.shape)
+
+    def end_mission(kinship, missions, start: int, stop: int):
+        # Same as Predictors.calculate_kinship_from_sum over the subtasks start to stop
+        weighted = subtasks.status[None, start:stop] * deviation[:, start:stop]
+        average = np.cumsum(weighted, axis=1)[:, -1] / (stop - start)
+        has_kinship = ~np.isnan(kinship) & (kinship != 0)
+        with np.errstate(invalid="ignore"):
+            kinship = np.where(has_kinship,
+                               ((missions * kinship) / (missions + 1)) + (average / (missions + 1)),
+                               average / (missions + 1))
+        return _round_batch(kinship), missions + 1
+
+    bounds = subtasks.mission_starts + [len(subtasks)]
+    for m, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if m:
+            kinship, missions = end_mission(kinship, missions, start_previous, start)
+        kinships[:, start:stop] = kinship[:, None]
+        start_previous = start
+    if subtasks.final_mission_ended:
+        kinship, missions = end_mission(kinship, missions, start_previous, len(subtasks))
+
+    trust, distrust, uncertainty = update_trust_vectors(positive_counts, negative_counts, kinships)
+    probability = probability_values(trust, distrust, uncertainty)
+    result = {"positive": positive_counts[:, -1], "negative": negative_counts[:, -1], "trust": trust[:, -1],
+              "distrust": distrust[:, -1], "uncertainty": uncertainty[:, -1], "kinship": kinship,
+              "missions": missions, "probability": probability[:, -1]}
+    if trajectories:
+        result.update({"predictor_value": predictor_value, "positive_steps": positive_counts,
+                       "negative_steps": negative_counts, "trust_steps": trust, "distrust_steps": distrust,
+                       "uncertainty_steps": uncertainty, "probability_steps": probability})
+    return result
+
+
+def sweep_user(user: str, source, grid: dict, as_frame: bool = True):
+    """
+    Evaluates a grid of settings over the recorded history of a user
+    @param source: storage holding the recorded configuration and history
+    @param grid: dict of parameter to array of grid point values, see make_grid
+    @param as_frame: return a pandas DataFrame, a dict of arrays otherwise
+    @return: one row per grid point with the parameters and the final state of sweep_subtasks,
+        None if the user has no history
+    """
+    import numpy as np
+    config = initial_config(user, source)
+    if config is None:
+        return None
+    recorded_missions = (source.load_config(user) or {}).get(MISSIONS_WORKED_TOGETHER)
+    subtasks = RecordedSubtasks(list(source.iter_history(user)), config[RESPONSE_TIME], recorded_missions)
+    points = len(grid[PARAMETERS[0]])
+    chunk = max(1, CHUNK_ELEMENTS // max(1, len(subtasks)))
+    parts = [sweep_subtasks(subtasks, config, {parameter: grid[parameter][start:start + chunk]
+                                               for parameter in PARAMETERS})
+             for start in range(0, points, chunk)]
+    result = {parameter: grid[parameter] for parameter in PARAMETERS}
+    result.update({name: np.concatenate([part[name] for part in parts]) for name in parts[0]})
+    if as_frame:
+        import pandas as pd
+        return pd.DataFrame(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate predictor settings over the recorded subtasks of a user")
+    parser.add_argument("user")
+    parser.add_argument("--source", default=os.path.join(os.path.dirname(__file__), "config"),
+                        help="config folder or sqlite .db file holding the recorded history")
+    for parameter in PARAMETERS:
+        parser.add_argument("--" + parameter.replace("_", "-"), type=float, nargs="+", default=None,
+                            help="values to sweep, the recorded setting if not given")
+    parser.add_argument("--output", help="csv file receiving the results, printed if not given")
+    args = parser.parse_args()
+    source = open_storage(args.source)
+    config = initial_config(args.user, source)
+    if config is None:
+        parser.error("No history for " + args.user)
+    defaults = {"predictor_threshold": config[PREDICTOR_THRESHOLD], "attitude": config[ATTITUDE],
+                "initial_kinship": float("nan") if config[KINSHIP] is None else config[KINSHIP],
+                "conformance_time_weight": 0.75, "conformance_response_weight": 0.25}
+    values = {parameter: getattr(args, parameter) or [defaults[parameter]] for parameter in PARAMETERS}
+    results = sweep_user(args.user, source, make_grid(**values))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    else:
+        print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import logging
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def quiet_logging():
+    """
+    Silences the per subtask logs of the sessions during a test, forked children inherit it
+    """
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def record_missions(config_dir: str, user: str, missions: list, end_last_mission: bool = True,
+                    predictor_threshold: float = None):
+    """
+    Applies missions to a session of the user one subtask at a time and writes the result
+    @param missions: list of missions, each a list of subtasks as keyword arguments of calculate_trust
+    @param end_last_mission: False leaves the last mission in progress
+    @return: FileStorage of config_dir
+    """
+    from human_interaction import InteractionAPI
+    from storage import FileStorage
+    user_storage = FileStorage(config_dir)
+    session = InteractionAPI(user, user_storage=user_storage)
+    if predictor_threshold is not None:
+        session.update_predictor_threshold(predictor_threshold)
+    for i, mission in enumerate(missions):
+        for subtask in mission:
+            session.calculate_trust(**subtask)
+        if i < len(missions) - 1 or end_last_mission:
+            session.update_kinship()
+    session.flush()
+    return user_storage
+
+
+@pytest.fixture
+def record():
+    return record_missions
@@ -0,0 +1,31 @@
+"""
+Conversion between the csv and the columnar history
+"""
+import pytest
+from storage import FileStorage
+
+pytest.importorskip("numpy")
+from columnar_history import ColumnarStorage  # noqa: E402
+
+
+def subtasks(count: int):
+    return [{"role": 1 + i % 3, "expected_time_for_task": 10, "actual_response_list": [1.0, 2.5],
+             "sub_task_status": i % 2, "actual_time_for_task": 9 + i % 4} for i in range(count)]
+
+
+def test_import_is_idempotent(tmp_path, record):
+    record(str(tmp_path), "operator1", [subtasks(20)], end_last_mission=False)
+    columnar = ColumnarStorage(str(tmp_path))
+    assert columnar.import_csv("operator1") == 20
+    assert columnar.import_csv("operator1") == 0
+    assert len(columnar.open_history("operator1")) == 20
+
+
+def test_import_continues_with_new_rows(tmp_path, record):
+    record(str(tmp_path), "operator1", [subtasks(20)], end_last_mission=False)
+    columnar = ColumnarStorage(str(tmp_path))
+    columnar.import_csv("operator1")
+    record(str(tmp_path), "operator1", [subtasks(5)], end_last_mission=False)
+    assert columnar.import_csv("operator1") == 5
+    csv_rows = list(FileStorage(str(tmp_path)).iter_history("operator1"))
+    assert list(columnar.iter_history("operator1")) == csv_rows
@@ -0,0 +1,60 @@
+"""
+Threads and processes updating the same users at once, no update may be lost
+"""
+import multiprocessing
+import threading
+from human_interaction import InteractionAPI
+from storage import FileStorage
+from utils import *
+
+USERS = ("operator1", "operator2")
+THREADS = 4
+PROCESSES = 3
+UPDATES = 25
+
+
+def update_users(config_dir: str, shared: bool):
+    """
+    Runs THREADS threads, each applying UPDATES subtasks to every user through one session per user
+    Odd updates reach their goal, even ones do not
+    """
+    user_storage = FileStorage(config_dir)
+    sessions = {user: InteractionAPI(user, user_storage=user_storage, shared=shared) for user in USERS}
+
+    def work():
+        for i in range(UPDATES):
+            for user in USERS:
+                sessions[user].calculate_trust(role=1, expected_time_for_task=10, actual_response_list=[1.0],
+                                               sub_task_status=i % 2, actual_time_for_task=9)
+
+    threads = [threading.Thread(target=work) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for session in sessions.values():
+        session.flush()
+
+
+def assert_counts(config_dir: str, updates: int):
+    user_storage = FileStorage(config_dir)
+    for user in USERS:
+        config = user_storage.load_config(user)
+        assert config[POSITIVE_EXP_COUNT] + config[NEGATIVE_EXP_COUNT] == updates
+        assert sum(1 for _ in user_storage.iter_history(user)) == updates
+
+
+def test_threads_of_one_process(tmp_path):
+    update_users(str(tmp_path), shared=False)
+    assert_counts(str(tmp_path), THREADS * UPDATES)
+
+
+def test_threads_of_several_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=update_users, args=(str(tmp_path), True)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert_counts(str(tmp_path), PROCESSES * THREADS * UPDATES)
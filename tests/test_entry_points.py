@@ -0,0 +1,118 @@
+"""
+The service and the ingestion daemon started from their command lines keep the fleet views up to date
+"""
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+from storage import FileStorage
+from shared_trust import SharedTrustTable
+from trust_index import TrustIndex
+from trust_service import TrustClient
+from utils import *
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBTASKS = [{"role": 1 + i % 3, "expected_time_for_task": 10, "actual_response_list": [1.0 + i],
+             "sub_task_status": i % 2, "actual_time_for_task": 8 + i} for i in range(4)]
+USERS = ("operator1", "operator2")
+
+
+def start(script: str, *args):
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, script)] + list(args), cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def wait_for(condition, process, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if process.poll() is not None:
+            raise Exception("Process ended early: " + process.stderr.read().decode())
+        if time.monotonic() > deadline:
+            raise Exception("Timed out")
+        time.sleep(0.05)
+
+
+def stop(process, signum):
+    process.send_signal(signum)
+    try:
+        process.wait(timeout=30)
+    finally:
+        process.stderr.close()
+
+
+@pytest.fixture
+def table_name():
+    name = "trust_test_%d" % os.getpid()
+    yield name
+    try:
+        SharedTrustTable(name).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def assert_views_match(tmp_path, table_name: str):
+    """
+    Checks the trust index and the shared trust table against the written configurations
+    """
+    index = TrustIndex(str(tmp_path / "index.db"))
+    rows = {row["user"]: row for row in index.query()}
+    index.close()
+    table = SharedTrustTable(table_name)
+    assert sorted(rows) == table.users() == list(USERS)
+    for user in USERS:
+        config = FileStorage(str(tmp_path / "config")).load_config(user)
+        assert config[POSITIVE_EXP_COUNT] + config[NEGATIVE_EXP_COUNT] == len(SUBTASKS)
+        assert rows[user]["trust"] == config[TRUST]
+        assert rows[user]["kinship"] == config[KINSHIP]
+        assert rows[user]["missions"] == config[MISSIONS_WORKED_TOGETHER]
+        assert table.read(user) == (config[TRUST], config[DISTRUST], config[UNCERTAINTY])
+    table.close()
+
+
+def test_ingest_command_line(tmp_path, table_name):
+    events = str(tmp_path / "events.jsonl")
+    with open(events, "w") as outfile:
+        for user in USERS:
+            for subtask in SUBTASKS:
+                outfile.write(json.dumps(dict(subtask, user=user)) + "\n")
+            outfile.write(json.dumps({"user": user, "event": "mission_end"}) + "\n")
+    checkpoint = str(tmp_path / "checkpoint.json")
+    process = start("ingest.py", events, "--storage", str(tmp_path / "config"), "--checkpoint", checkpoint,
+                    "--dead-letter", str(tmp_path / "dead_letter.jsonl"), "--batch-interval", "0.05",
+                    "--trust-index", str(tmp_path / "index.db"), "--trust-table", table_name)
+
+    def applied():
+        if not os.path.isfile(checkpoint):
+            return False
+        with open(checkpoint) as infile:
+            return json.load(infile)["offsets"].get(events) == os.path.getsize(events)
+    try:
+        wait_for(applied, process)
+    finally:
+        stop(process, signal.SIGTERM)
+    assert_views_match(tmp_path, table_name)
+
+
+@pytest.mark.skipif(not hasattr(asyncio, "open_unix_connection"), reason="needs unix sockets")
+def test_service_command_line(tmp_path, table_name):
+    socket_path = str(tmp_path / "trust.sock")
+    process = start("trust_service.py", "--unix", socket_path, "--storage", str(tmp_path / "config"),
+                    "--trust-index", str(tmp_path / "index.db"), "--trust-table", table_name)
+
+    async def run():
+        client = await TrustClient.connect(unix_path=socket_path)
+        for user in USERS:
+            await client.call(user, "calculate_trust_batch", records=SUBTASKS)
+            await client.call(user, "update_kinship")
+        await client.close()
+    try:
+        wait_for(lambda: os.path.exists(socket_path), process)
+        asyncio.run(run())
+        # The index and the table follow the updates while the service runs
+        assert_views_match(tmp_path, table_name)
+    finally:
+        stop(process, signal.SIGINT)
@@ -0,0 +1,109 @@
+"""
+Events applied by the ingestion daemon, missions spanning evictions and restarts
+"""
+import json
+import os
+import queue
+import time
+import pytest
+from human_interaction import InteractionAPI
+from ingest import MISSION_END, IngestionDaemon, SourceReader, parse_event
+from session_registry import SessionRegistry
+from storage import FileStorage
+from utils import *
+
+SUBTASKS = [{"role": 1 + i % 3, "expected_time_for_task": 10, "actual_response_list": [1.0 + i],
+             "sub_task_status": i % 2, "actual_time_for_task": 8 + i} for i in range(6)]
+
+
+def event(user: str, subtask: dict = None):
+    line = dict(subtask, user=user) if subtask else {"user": user, "event": MISSION_END}
+    return "events.jsonl", None, parse_event(json.dumps(line).encode())
+
+
+def new_daemon(config_dir: str, capacity: int = 1):
+    registry = SessionRegistry(capacity, user_storage=FileStorage(config_dir))
+    return IngestionDaemon([], registry, checkpoint_path=config_dir + "/checkpoint.json",
+                           dead_letter_path=config_dir + "/dead_letter.jsonl")
+
+
+@pytest.mark.parametrize("user", ["../operator1", "team/operator1", "..", ""])
+def test_user_outside_config_folder_rejected(user):
+    with pytest.raises(ValueError):
+        parse_event(json.dumps(dict(SUBTASKS[0], user=user)).encode())
+
+
+def test_mission_survives_eviction(tmp_path, record):
+    daemon = new_daemon(str(tmp_path))
+    daemon.apply_batch([event("operator1", subtask) for subtask in SUBTASKS[:3]])
+    # Capacity 1, the session of operator1 is evicted mid mission
+    daemon.apply_batch([event("operator2", SUBTASKS[0])])
+    daemon.apply_batch([event("operator1", subtask) for subtask in SUBTASKS[3:]] + [event("operator1")])
+    config = FileStorage(str(tmp_path)).load_config("operator1")
+    assert config == record(str(tmp_path), "expected", [SUBTASKS]).load_config("expected")
+    assert "operator1" not in daemon.missions
+
+
+def test_mission_survives_restart(tmp_path, record):
+    daemon = new_daemon(str(tmp_path))
+    daemon.apply_batch([event("operator1", subtask) for subtask in SUBTASKS[:4]])
+    daemon.registry.clear()
+    daemon = new_daemon(str(tmp_path))
+    assert daemon.missions["operator1"].count == 4
+    daemon.apply_batch([event("operator1", subtask) for subtask in SUBTASKS[4:]] + [event("operator1")])
+    expected = record(str(tmp_path), "expected", [SUBTASKS]).load_config("expected")
+    assert FileStorage(str(tmp_path)).load_config("operator1") == expected
+
+
+def test_checkpoint_of_offsets_only(tmp_path):
+    with open(str(tmp_path / "checkpoint.json"), "w") as outfile:
+        json.dump({"events.jsonl": 120}, outfile)
+    daemon = new_daemon(str(tmp_path))
+    assert daemon.offsets == {"events.jsonl": 120}
+    assert daemon.missions == {}
+
+
+def test_failed_events_go_to_dead_letter(tmp_path, monkeypatch):
+    daemon = new_daemon(str(tmp_path), capacity=4)
+    calculate_trust_batch = InteractionAPI.calculate_trust_batch
+    calls = []
+
+    def fail_second_batch(session, records):
+        calls.append(session.user)
+        if session.user == "operator1" and calls.count("operator1") == 2:
+            raise OSError("disk full")
+        return calculate_trust_batch(session, records)
+    monkeypatch.setattr(InteractionAPI, "calculate_trust_batch", fail_second_batch)
+    batch = [event("operator1", SUBTASKS[0]), event("operator1"), event("operator2", SUBTASKS[1]),
+             event("operator1", SUBTASKS[2]), event("operator1", SUBTASKS[3]), event("operator1")]
+    batch = [(path, 100 * (i + 1), item) for i, (path, offset, item) in enumerate(batch)]
+    daemon.apply_batch(batch)
+    # The first mission of operator1 and the subtask of operator2 are applied, the second batch fails
+    assert daemon.applied == 3
+    assert daemon.failed == 3
+    assert daemon.offsets == {"events.jsonl": 600}
+    with open(str(tmp_path / "dead_letter.jsonl")) as infile:
+        lines = infile.readlines()
+    assert [line["offset"] for line in map(json.loads, lines)] == [400, 500, 600]
+    assert json.loads(lines[0])["error"] == "OSError: disk full"
+    # Dead letters are events again
+    assert [parse_event(line.encode()) for line in lines] == [item for path, offset, item in batch[3:]]
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs FIFOs")
+def test_fifo_read_across_writers(tmp_path):
+    path = str(tmp_path / "events.fifo")
+    os.mkfifo(path)
+    events = queue.Queue()
+    reader = SourceReader(path, events, poll_interval=0.05)
+    reader.start()
+    try:
+        time.sleep(0.1)
+        for subtask in SUBTASKS[:2]:
+            with open(path, "w") as outfile:
+                outfile.write(json.dumps(dict(subtask, user="operator1")) + "\n")
+        received = [events.get(timeout=5) for _ in range(2)]
+    finally:
+        reader.stop()
+        reader.join()
+    assert [item[2]["role"] for item in received] == [subtask["role"] for subtask in SUBTASKS[:2]]
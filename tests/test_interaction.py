@@ -0,0 +1,71 @@
+"""
+InteractionAPI sessions applying subtasks and missions
+"""
+import pytest
+from human_interaction import InteractionAPI
+from predictors import Predictors
+from storage import MemoryStorage
+from utils import *
+
+SUBTASK = {"role": 2, "expected_time_for_task": 10, "actual_response_list": [1.0], "sub_task_status": 1,
+           "actual_time_for_task": 9}
+
+
+@pytest.fixture
+def session():
+    session = InteractionAPI("operator1", user_storage=MemoryStorage())
+    session.calculate_trust_batch([SUBTASK, SUBTASK])
+    return session
+
+
+def state(session):
+    statistics = session.statistics
+    return ([getattr(statistics, name) for name in statistics.__slots__], dict(session.user_predictor.config),
+            list(session.read_history()))
+
+
+def test_invalid_subtask_rejects_whole_batch(session):
+    before = state(session)
+    with pytest.raises(ValueError):
+        session.calculate_trust_batch([SUBTASK, dict(SUBTASK, role=4)])
+    assert state(session) == before
+
+
+def test_failing_subtask_restores_statistics(session, monkeypatch):
+    before = state(session)
+    calls = []
+
+    def calculate_conformance(predictor, *args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise ZeroDivisionError("conformance")
+        return 0.5
+    monkeypatch.setattr(Predictors, "calculate_conformance", calculate_conformance)
+    with pytest.raises(ZeroDivisionError):
+        session.calculate_trust_batch([SUBTASK, SUBTASK])
+    assert state(session) == before
+    session.update_kinship()
+    assert session.user_predictor.config[MISSIONS_WORKED_TOGETHER] == 1
+
+
+def test_session_state_is_slotted(session):
+    # The memory of a live session does not grow with attributes added along the way
+    for state_object in (session, session.user_predictor, session.user_predictor.config_manager, session.history,
+                         session.statistics):
+        assert not hasattr(state_object, "__dict__")
+
+
+def test_history_buffer_bytes_bounds_buffer():
+    user_storage = MemoryStorage()
+    # Rows would stay buffered up to a thousand of them without the byte cap
+    session = InteractionAPI("operator1", user_storage=user_storage, history_flush_every=1000,
+                             history_buffer_bytes=4096)
+    for count in range(1, 1000):
+        session.calculate_trust(**SUBTASK)
+        written = list(user_storage.iter_history("operator1"))
+        if written:
+            break
+    assert 1 < count < 1000
+    assert len(written) == count
+    assert session.history.buffer == []
+    assert session.history.buffer_bytes == 0
@@ -0,0 +1,104 @@
+"""
+A process killed while it updates a journaled user loses no update it acknowledged
+The child writes configurations once an hour and buffers a thousand history rows, so only the journal
+holds its updates when it dies
+"""
+import multiprocessing
+import os
+import signal
+import pytest
+from human_interaction import InteractionAPI
+from journal import Journal
+from storage import FileStorage
+from utils import *
+
+USER = "operator1"
+# Subtask during which the child exits, after journaling it and before applying it, in the first mission
+EXIT_AT = 8
+
+
+def open_session(config_dir: str):
+    return InteractionAPI(USER, history_flush_every=1000, config_flush_interval=3600,
+                          user_storage=FileStorage(config_dir), journal=True, journal_compact_every=1000)
+
+
+def apply_updates(config_dir: str, connection):
+    """
+    Applies subtasks, with a mission end every ten subtasks, until the process is killed
+    The number of each subtask is sent once its update returns
+    """
+    session = open_session(config_dir)
+    i = 0
+    while True:
+        session.calculate_trust(role=1 + i % 3, expected_time_for_task=10, actual_response_list=[1.0],
+                                sub_task_status=i % 2, actual_time_for_task=9 + i % 3)
+        if i % 10 == 9:
+            session.update_kinship()
+        i += 1
+        connection.send(i)
+
+
+def exit_after_journal(config_dir: str, connection):
+    append = Journal.append
+
+    def append_then_exit(journal, config, rows=()):
+        append(journal, config, rows)
+        if journal.entries == EXIT_AT:
+            os._exit(1)
+    Journal.append = append_then_exit
+    apply_updates(config_dir, connection)
+
+
+def run_child(target, config_dir: str, acknowledged: int = None):
+    """
+    @return: number of the last update the child acknowledged
+    """
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=target, args=(config_dir, sender))
+    child.start()
+    sender.close()
+    last = 0
+    while True:
+        try:
+            last = receiver.recv()
+        except EOFError:
+            break
+        if acknowledged is not None and last >= acknowledged:
+            os.kill(child.pid, signal.SIGKILL)
+            break
+    child.join()
+    assert child.exitcode != 0
+    return last
+
+
+def assert_recovered(config_dir: str, acknowledged: int):
+    session = open_session(config_dir)
+    config = session.user_predictor.config
+    subtasks = config[POSITIVE_EXP_COUNT] + config[NEGATIVE_EXP_COUNT]
+    assert subtasks >= acknowledged
+    rows = list(session.read_history())
+    assert len(rows) == subtasks
+    assert [row["positive exp Count"] for row in rows][-1] == config[POSITIVE_EXP_COUNT]
+    assert rows[-1]["Trust"] == config[TRUST]
+    assert config[MISSIONS_WORKED_TOGETHER] >= acknowledged // 10
+    session.flush()
+    return subtasks
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_exit_between_journal_and_update(tmp_path):
+    acknowledged = run_child(exit_after_journal, str(tmp_path))
+    # Only the journal holds the subtasks, the configuration is the one written for a new user
+    assert FileStorage(str(tmp_path)).load_config(USER)[POSITIVE_EXP_COUNT] == 0
+    assert not list(FileStorage(str(tmp_path)).iter_history(USER))
+    # Subtasks before EXIT_AT were acknowledged, EXIT_AT was journaled but never applied
+    assert acknowledged == EXIT_AT - 1
+    assert assert_recovered(str(tmp_path), acknowledged) == EXIT_AT
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_sigkill(tmp_path):
+    acknowledged = run_child(apply_updates, str(tmp_path), acknowledged=40)
+    assert len(list(FileStorage(str(tmp_path)).iter_history(USER))) < acknowledged
+    assert_recovered(str(tmp_path), acknowledged)
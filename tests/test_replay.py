@@ -0,0 +1,52 @@
+"""
+Replays and sweeps of a recorded history give back the recorded configuration and history
+"""
+import csv
+import pytest
+from human_interaction import HISTORY_COLUMNS, InteractionAPI
+from replay import replay_user
+from storage import FileStorage
+from utils import *
+
+FIELDS = ("role", "expected_time_for_task", "actual_response_list", "sub_task_status", "actual_time_for_task")
+# Missions of two identical subtasks, kinship does not change from one mission to the next
+MISSIONS = [[dict(zip(FIELDS, subtask)) for subtask in mission]
+            for mission in [[(1, 10, [1.0], 1, 9)] * 2] * 3 + [[(2, 10, [3.0], 0, 14), (3, 10, [1.0], 1, 8)]]]
+
+
+@pytest.mark.parametrize("end_last_mission", [True, False])
+def test_replay_reproduces_recording(tmp_path, record, end_last_mission):
+    source = record(str(tmp_path / "source"), "operator1", MISSIONS, end_last_mission, predictor_threshold=0.7)
+    output = FileStorage(str(tmp_path / "output"))
+    assert replay_user("operator1", source, output) == sum(len(mission) for mission in MISSIONS)
+    recorded = source.load_config("operator1")
+    assert recorded[MISSIONS_WORKED_TOGETHER] == len(MISSIONS) - (not end_last_mission)
+    assert output.load_config("operator1") == recorded
+    assert list(output.iter_history("operator1")) == list(source.iter_history("operator1"))
+
+
+def test_sweep_matches_recording(tmp_path, record):
+    sweep = pytest.importorskip("sweep")
+    source = record(str(tmp_path), "operator1", MISSIONS, predictor_threshold=0.7)
+    config = source.load_config("operator1")
+    grid = sweep.make_grid(predictor_threshold=[0.7], attitude=[config[ATTITUDE]], initial_kinship=[float("nan")],
+                           conformance_time_weight=[0.75], conformance_response_weight=[0.25])
+    result = sweep.sweep_user("operator1", source, grid, as_frame=False)
+    assert result["missions"][0] == config[MISSIONS_WORKED_TOGETHER]
+    assert result["kinship"][0] == config[KINSHIP]
+    assert result["trust"][0] == pytest.approx(config[TRUST])
+
+
+def test_older_history_gets_mission_column(tmp_path):
+    user_storage = FileStorage(str(tmp_path))
+    with open(user_storage.history_path("operator1"), "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(HISTORY_COLUMNS[:-1])
+        writer.writerow(["", 1, 0, 0.1, 0.0, 0.9, "", 0.7, 1, 1, 9, 10, 1, [1.0], 1, 0.9])
+    session = InteractionAPI("operator1", user_storage=user_storage)
+    session.calculate_trust(role=1, expected_time_for_task=10, actual_response_list=[1.0], sub_task_status=1,
+                            actual_time_for_task=9)
+    session.flush()
+    rows = list(user_storage.iter_history("operator1"))
+    assert [row["mission"] for row in rows] == [None, 0]
+    assert rows[0]["Trust"] == 0.1
@@ -0,0 +1,35 @@
+"""
+Sessions dropped by the registry mid mission, the next session of the user continues the mission
+"""
+from session_registry import SessionRegistry
+from storage import FileStorage
+from utils import *
+
+SUBTASKS = [{"role": 1 + i % 3, "expected_time_for_task": 10, "actual_response_list": [1.0 + i],
+             "sub_task_status": i % 2, "actual_time_for_task": 8 + i} for i in range(4)]
+
+
+def test_evicted_session_continues_mission(tmp_path, record):
+    registry = SessionRegistry(1, user_storage=FileStorage(str(tmp_path)))
+    for subtask in SUBTASKS:
+        registry.get("a").calculate_trust(**subtask)
+        # Capacity 1, every call of b evicts a in the middle of its mission
+        registry.get("b").calculate_trust(**subtask)
+    assert MISSION_IN_PROGRESS in FileStorage(str(tmp_path)).load_config("a")
+    registry.get("a").update_kinship()
+    registry.clear()
+    config = FileStorage(str(tmp_path)).load_config("a")
+    assert MISSION_IN_PROGRESS not in config
+    assert config == record(str(tmp_path), "expected", [SUBTASKS]).load_config("expected")
+
+
+def test_cleared_registry_continues_mission(tmp_path, record):
+    registry = SessionRegistry(4, user_storage=FileStorage(str(tmp_path)))
+    registry.get("a").calculate_trust_batch(SUBTASKS[:1])
+    registry.clear()
+    registry = SessionRegistry(4, user_storage=FileStorage(str(tmp_path)))
+    registry.get("a").calculate_trust_batch(SUBTASKS[1:])
+    registry.get("a").update_kinship()
+    registry.clear()
+    expected = record(str(tmp_path), "expected", [SUBTASKS]).load_config("expected")
+    assert FileStorage(str(tmp_path)).load_config("a") == expected
@@ -0,0 +1,30 @@
+"""
+Synthetic operators driven through the trust pipeline
+"""
+import pytest
+import simulation
+
+np = pytest.importorskip("numpy")
+
+
+def test_attitude_changes_outcomes(monkeypatch):
+    draw = simulation.OperatorProfile.draw
+    results = {}
+    for attitude in (0.0, 1.0):
+        def draw_with_attitude(rng):
+            profile = draw(rng)
+            profile.attitude = attitude
+            return profile
+        monkeypatch.setattr(simulation.OperatorProfile, "draw", staticmethod(draw_with_attitude))
+        results[attitude] = simulation.simulate_operator(0, np.random.SeedSequence(3), 5, 8)
+    assert results[0.0]["subtasks"] == results[1.0]["subtasks"]
+    assert results[0.0]["profile"]["attitude"] == 0.0
+    # Competency counts attitude, a positive attitude gives more positive experiences
+    assert results[1.0]["positive"] > results[0.0]["positive"]
+
+
+def test_results_do_not_depend_on_processes():
+    one = simulation.run_simulation(operators=6, missions=3, subtasks_per_mission=4, seed=5, processes=1)
+    two = simulation.run_simulation(operators=6, missions=3, subtasks_per_mission=4, seed=5, processes=2,
+                                    chunk_size=2)
+    assert one["operators"] == two["operators"]
@@ -0,0 +1,39 @@
+"""
+Requests through the socket of the trust service, with sessions evicted mid mission
+"""
+import asyncio
+from session_registry import SessionRegistry
+from storage import FileStorage
+from trust_service import TrustClient, TrustService
+from utils import *
+
+SUBTASKS = [{"role": 1 + i % 3, "expected_time_for_task": 10, "actual_response_list": [1.0 + i],
+             "sub_task_status": i % 2, "actual_time_for_task": 8 + i} for i in range(4)]
+USERS = ["operator%d" % i for i in range(3)]
+
+
+def test_mission_end_after_eviction(tmp_path, record):
+    service = TrustService(SessionRegistry(1, user_storage=FileStorage(str(tmp_path))), workers=2)
+
+    async def run():
+        await service.start(unix_path=str(tmp_path / "trust.sock"))
+        client = await TrustClient.connect(unix_path=str(tmp_path / "trust.sock"))
+        # Capacity 1, every request evicts the session of the previous user
+        for subtask in SUBTASKS:
+            for user in USERS:
+                await client.call(user, "calculate_trust", **subtask)
+        for user in USERS:
+            await client.call(user, "update_kinship")
+        await client.close()
+        service.server.close()
+        await service.server.wait_closed()
+        # Let the loop run the lock cleanup scheduled by the evictions
+        await asyncio.sleep(0)
+        return set(service.user_locks)
+
+    locks = asyncio.run(run())
+    assert locks == set(USERS[-1:])
+    service.close()
+    expected = record(str(tmp_path), "expected", [SUBTASKS]).load_config("expected")
+    for user in USERS:
+        assert FileStorage(str(tmp_path)).load_config(user) == expected
@@ -1,7 +1,403 @@
-import scipy.integrate as spi
-import scipy.special as sc
+"""
+Trust vector of a user from the positive and negative experience counts
+numpy and scipy are only imported by the code paths that need them, so importing this module stays cheap,
+and the scalar certainty falls back to pure python special functions when scipy is not installed
+"""
+import functools
+import logging
+import math
 from sys import exit
 
+logger = logging.getLogger(__name__)
+
+# Number of (p_count, n_count) pairs whose certainty is memoized per process
+CERTAINTY_CACHE_SIZE = 4096
+
+# Optional precomputed table consulted before the cache, see certainty_table.py
+certainty_table = None
+
+# Smallest positive float and largest float below 1, the ends of the interval searched for density crossings
+SMALLEST_POSITIVE = 5e-324
+LARGEST_BELOW_ONE = 1.0 - 2 ** -53
+
+
+_special = None
+
+
+def _special_functions():
+    """
+    Imports scipy.special on first use
+    @return: scipy.special module, None if scipy is not installed
+    """
+    global _special
+    if _special is None:
+        try:
+            import scipy.special as sc
+            _special = sc
+        except ImportError:
+            _special = False
+    return _special or None
+
+
+def _log_beta_function(a, b):
+    """
+    Pure python logarithm of the beta function
+    """
+    return math.lgamma(a) + math.lgamma(b) - math.lgamma(a + b)
+
+
+def _beta_continued_fraction(a, b, x):
+    """
+    Continued fraction of the incomplete beta function evaluated with the modified Lentz method
+    """
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 100000):
+        m2 = 2 * m
+        numerator = m * (b - m) * x / ((a + m2 - 1) * (a + m2))
+        d = 1.0 + numerator * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        numerator = -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1))
+        d = 1.0 + numerator * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-16:
+            break
+    return h
+
+
+def _incomplete_beta(a, b, x, log_beta):
+    """
+    Pure python regularized incomplete beta I_x(a, b)
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(a * math.log(x) + b * math.log1p(-x) - log_beta)
+    if x < (a + 1) / (a + b + 2):
+        return front * _beta_continued_fraction(a, b, x) / a
+    return 1.0 - front * _beta_continued_fraction(b, a, 1 - x) / b
+
+
+def _log_beta_density(p_i, p_count, n_count, log_beta):
+    """
+    Logarithm of the Beta(p_count, n_count) density at p_i
+    Working in log space keeps the density finite for large experience counts
+    """
+    log_density = -log_beta
+    if p_count != 1:
+        log_density += (p_count - 1) * math.log(p_i)
+    if n_count != 1:
+        log_density += (n_count - 1) * math.log1p(-p_i)
+    return log_density
+
+
+def _density_crossing(lower, upper, p_count, n_count, log_beta):
+    """
+    Finds the point in [lower, upper] where the Beta density crosses 1
+    Newton steps on the log density are kept inside a shrinking bracket and fall back to bisection.
+    If the density does not change sides of 1 within the interval the nearest end point is returned
+    @return: float value between lower and upper
+    """
+    f_lower = _log_beta_density(lower, p_count, n_count, log_beta)
+    f_upper = _log_beta_density(upper, p_count, n_count, log_beta)
+    if f_lower * f_upper > 0:
+        return lower if abs(f_lower) < abs(f_upper) else upper
+    lower_negative = f_lower < 0
+    x = (lower + upper) / 2
+    if p_count > 1 and n_count > 1:
+        # Normal approximation around the mode gives a starting point close to the crossing
+        mode = (p_count - 1) / (p_count + n_count - 2)
+        spread = math.sqrt(mode * (1 - mode) / (p_count + n_count - 2))
+        height = _log_beta_density(mode, p_count, n_count, log_beta) if 0 < mode < 1 else 0
+        offset = spread * math.sqrt(2 * max(height, 0))
+        x = mode - offset if upper <= mode else mode + offset
+        if not lower < x < upper:
+            x = (lower + upper) / 2
+    for _ in range(100):
+        f_x = _log_beta_density(x, p_count, n_count, log_beta)
+        if abs(f_x) < 1e-12:
+            # The certainty is flat in the crossing point so this is well below float precision
+            return x
+        if (f_x < 0) == lower_negative:
+            lower = x
+        else:
+            upper = x
+        slope = (p_count - 1) / x - (n_count - 1) / (1 - x)
+        x_new = x - f_x / slope if slope else lower - 1
+        if not lower < x_new < upper:
+            x_new = (lower + upper) / 2
+        if abs(x_new - x) <= 1e-15 * max(x, 1e-300) or x_new in (lower, upper):
+            return x_new
+        x = x_new
+    return x
+
+
+def closed_form_certainty(p_count, n_count):
+    """
+    Evaluates certainty exactly without numerical integration
+    When both counts are non zero certainty is half the L1 distance between the Beta(p_count, n_count)
+    density and the uniform density. As both integrate to 1 this equals the mass of the density above 1
+    minus the length of the region where it is above 1, which is read from the regularized incomplete beta.
+    Counts below 1 make the density unbounded at an end, the regions above 1 then touch that end.
+    When one of the counts is zero the density is (1-p)^(n-1) or p^(p-1) without normalization,
+    which integrates to |1 - 1/count|
+    @return: certainty value, None if both counts are zero
+    :rtype: float
+    """
+    if p_count != 0 and n_count != 0:
+        if p_count == 1 and n_count == 1:
+            # Uniform density, no evidence either way
+            return 0.0
+        sc = _special_functions()
+        if sc is not None:
+            log_beta = float(sc.betaln(p_count, n_count))
+            betainc = sc.betainc
+        else:
+            log_beta = _log_beta_function(p_count, n_count)
+            betainc = functools.partial(_incomplete_beta, log_beta=log_beta)
+        # The log density is finite everywhere inside the open interval
+        lower = SMALLEST_POSITIVE if p_count != 1 else 0.0
+        upper = LARGEST_BELOW_ONE if n_count != 1 else 1.0
+        if p_count < 1 and n_count < 1:
+            # U shaped density, above 1 near both ends and below 1 around its minimum
+            minimum = (1 - p_count) / (2 - p_count - n_count)
+            x_1 = _density_crossing(lower, minimum, p_count, n_count, log_beta)
+            x_2 = _density_crossing(minimum, upper, p_count, n_count, log_beta)
+            mass = betainc(p_count, n_count, x_1) + 1 - betainc(p_count, n_count, x_2)
+            return max(0.0, float(mass - (x_1 + 1 - x_2)))
+        if p_count < 1:
+            # Density is decreasing from infinity at 0
+            x_1, x_2 = 0.0, _density_crossing(lower, upper, p_count, n_count, log_beta)
+        elif n_count < 1:
+            # Density is increasing to infinity at 1
+            x_1, x_2 = _density_crossing(lower, upper, p_count, n_count, log_beta), 1.0
+        else:
+            mode = (p_count - 1) / (p_count + n_count - 2)
+            if p_count > 1:
+                x_1 = _density_crossing(lower, mode, p_count, n_count, log_beta)
+            else:
+                # Density is decreasing and starts above 1
+                x_1 = 0.0
+            if n_count > 1:
+                x_2 = _density_crossing(mode, upper, p_count, n_count, log_beta)
+            else:
+                # Density is increasing and ends above 1
+                x_2 = 1.0
+        mass = betainc(p_count, n_count, x_2) - betainc(p_count, n_count, x_1)
+        return max(0.0, float(mass - (x_2 - x_1)))
+    elif p_count == 0 and n_count != 0:
+        return abs(1 - 1 / n_count)
+    elif n_count == 0 and p_count != 0:
+        return abs(1 - 1 / p_count)
+    return None
+
+
+@functools.lru_cache(maxsize=CERTAINTY_CACHE_SIZE)
+def cached_certainty(p_count, n_count):
+    """
+    Memoized closed_form_certainty, the value only depends on the pair of counts
+    """
+    return closed_form_certainty(p_count, n_count)
+
+
+def use_certainty_table(table):
+    """
+    Registers a precomputed certainty table for every Trust in this process
+    @param table: CertaintyTable or None to go back to direct computation
+    """
+    global certainty_table
+    certainty_table = table
+
+
+def _log_beta_density_batch(p_i, p_count, n_count, log_beta):
+    """
+    Array version of _log_beta_density
+    """
+    import numpy as np
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_density = -log_beta + np.where(p_count != 1, (p_count - 1) * np.log(p_i), 0.0)
+        log_density += np.where(n_count != 1, (n_count - 1) * np.log1p(-p_i), 0.0)
+    return log_density
+
+
+def _density_crossing_batch(lower, upper, p_count, n_count, log_beta):
+    """
+    Array version of _density_crossing, only rows which have not converged are iterated
+    @return: array of crossing points
+    """
+    import numpy as np
+    f_lower = _log_beta_density_batch(lower, p_count, n_count, log_beta)
+    f_upper = _log_beta_density_batch(upper, p_count, n_count, log_beta)
+    result = np.where(np.abs(f_lower) < np.abs(f_upper), lower, upper)
+    active = np.flatnonzero(f_lower * f_upper <= 0)
+    lower_negative = (f_lower < 0)[active]
+    lower, upper = lower[active], upper[active]
+    p_count, n_count, log_beta = p_count[active], n_count[active], log_beta[active]
+
+    mode = (p_count - 1) / (p_count + n_count - 2)
+    spread = np.sqrt(mode * (1 - mode) / (p_count + n_count - 2))
+    inner = (mode > 0) & (mode < 1)
+    height = np.where(inner, _log_beta_density_batch(np.where(inner, mode, 0.5), p_count, n_count, log_beta), 0)
+    offset = spread * np.sqrt(2 * np.maximum(height, 0))
+    x = np.where(upper <= mode, mode - offset, mode + offset)
+    x = np.where((lower < x) & (x < upper), x, (lower + upper) / 2)
+    for _ in range(100):
+        if not active.size:
+            break
+        f_x = _log_beta_density_batch(x, p_count, n_count, log_beta)
+        on_lower_side = (f_x < 0) == lower_negative
+        lower = np.where(on_lower_side, x, lower)
+        upper = np.where(on_lower_side, upper, x)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (p_count - 1) / x - (n_count - 1) / (1 - x)
+            x_new = x - f_x / slope
+        x_new = np.where((lower < x_new) & (x_new < upper), x_new, (lower + upper) / 2)
+        done = ((np.abs(f_x) < 1e-12) | (np.abs(x_new - x) <= 1e-15 * np.maximum(x, 1e-300))
+                | (x_new == lower) | (x_new == upper))
+        result[active] = np.where(np.abs(f_x) < 1e-12, x, x_new)
+        keep = ~done
+        active, lower_negative = active[keep], lower_negative[keep]
+        lower, upper, x = lower[keep], upper[keep], x_new[keep]
+        p_count, n_count, log_beta = p_count[keep], n_count[keep], log_beta[keep]
+    return result
+
+
+def calculate_certainty_batch(p_counts, n_counts):
+    """
+    Vectorized closed_form_certainty over arrays of experience counts
+    @param p_counts: array of positive experience counts
+    @param n_counts: array of negative experience counts
+    @return: array of certainty values, NaN where both counts are zero
+    """
+    import numpy as np
+    import scipy.special as sc
+    p_counts, n_counts = np.broadcast_arrays(np.asarray(p_counts, dtype=float), np.asarray(n_counts, dtype=float))
+    certainty = np.full(p_counts.shape, np.nan)
+    with np.errstate(divide="ignore"):
+        certainty = np.where((p_counts == 0) & (n_counts != 0), np.abs(1 - 1 / n_counts), certainty)
+        certainty = np.where((n_counts == 0) & (p_counts != 0), np.abs(1 - 1 / p_counts), certainty)
+    both = (p_counts != 0) & (n_counts != 0)
+    certainty[both & (p_counts == 1) & (n_counts == 1)] = 0.0
+
+    index = np.flatnonzero(both & ((p_counts != 1) | (n_counts != 1)))
+    if index.size:
+        a, b = p_counts.ravel()[index], n_counts.ravel()[index]
+        # Certainty only depends on the pair of counts, which repeat heavily across a fleet
+        if np.all(a == np.floor(a)) and np.all(b == np.floor(b)) and b.max() < 2 ** 31:
+            keys, inverse = np.unique(a.astype(np.int64) << 32 | b.astype(np.int64), return_inverse=True)
+            a, b = (keys >> 32).astype(float), (keys & 0xFFFFFFFF).astype(float)
+        else:
+            pairs, inverse = np.unique(a + 1j * b, return_inverse=True)
+            a, b = pairs.real, pairs.imag
+        values = np.empty(a.size)
+        # Counts below 1 make the density unbounded at an end, these rare pairs go through the scalar path
+        fractional = (a < 1) | (b < 1)
+        for i in np.flatnonzero(fractional):
+            values[i] = cached_certainty(float(a[i]), float(b[i]))
+        regular = np.flatnonzero(~fractional)
+        a, b = a[regular], b[regular]
+        log_beta = sc.betaln(a, b)
+        mode = (a - 1) / (a + b - 2)
+        x_1 = np.zeros_like(a)
+        x_2 = np.ones_like(a)
+        left = np.flatnonzero(a > 1)
+        if left.size:
+            x_1[left] = _density_crossing_batch(np.full(left.size, SMALLEST_POSITIVE), mode[left],
+                                                a[left], b[left], log_beta[left])
+        right = np.flatnonzero(b > 1)
+        if right.size:
+            x_2[right] = _density_crossing_batch(mode[right], np.full(right.size, LARGEST_BELOW_ONE),
+                                                 a[right], b[right], log_beta[right])
+        mass = sc.betainc(a, b, x_2) - sc.betainc(a, b, x_1)
+        values[regular] = np.maximum(0.0, mass - (x_2 - x_1))
+        certainty.ravel()[index] = values[inverse.ravel()]
+    return certainty
+
+
+def _round_batch(values, digits=2):
+    """
+    Rounds like the builtin round, which rounds the exact decimal value of a float.
+    np.round scales by a power of ten first, so the few values close to a tie are redone with round
+    """
+    import numpy as np
+    scale = 10.0 ** digits
+    scaled = values * scale
+    rounded = np.round(scaled) / scale
+    ties = np.flatnonzero(np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6)
+    for i in ties:
+        rounded.flat[i] = round(float(values.flat[i]), digits)
+    return rounded
+
+
+def update_trust_vectors(p_counts, n_counts, kinships=None):
+    """
+    Calculates trust, distrust and uncertainty for many users in one pass
+    Follows Trust.update_trust_vector element by element: the kinship formulas are used where kinship
+    is set and non zero, the no kinship formulas elsewhere
+    @param p_counts: array of positive experience counts
+    @param n_counts: array of negative experience counts
+    @param kinships: array of kinship values, NaN where kinship is not set
+    @return: arrays of trust, distrust and uncertainty, NaN where both counts are zero
+    """
+    import numpy as np
+    p_counts, n_counts = np.broadcast_arrays(np.asarray(p_counts, dtype=float), np.asarray(n_counts, dtype=float))
+    if kinships is None:
+        kinships = np.full(p_counts.shape, np.nan)
+    kinships = np.broadcast_to(np.asarray(kinships, dtype=float), p_counts.shape)
+    c_b = calculate_certainty_batch(p_counts, n_counts)
+    total = p_counts + n_counts
+    has_kinship = ~np.isnan(kinships) & (kinships != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trust = np.where(has_kinship, kinships * p_counts * c_b / total, p_counts * c_b / total)
+        distrust = np.where(has_kinship, (1 - kinships) * n_counts * c_b / total, n_counts * c_b / total)
+    trust = _round_batch(trust)
+    distrust = _round_batch(distrust)
+    uncertainty = _round_batch(1 - (trust + distrust))
+    return trust, distrust, uncertainty
+
+
+def probability_value(trust, distrust, uncertainty):
+    """
+    Probability with which the robot considers the suggestion of the human
+    @return: 1 while the human is not distrusted or the robot is uncertain, lower as distrust outweighs trust
+    """
+    if not (trust or distrust):
+        # First interaction
+        return 1
+    if uncertainty > (trust + distrust):
+        # Always work with human as robot is not certain
+        return 1
+    if trust >= distrust:
+        # Trust value is more. Robot works with human
+        return 1
+    # Distrust value is more. So robot works with human with a probability
+    return 1 - ((distrust - trust) / (trust + distrust))
+
+
+def probability_values(trust, distrust, uncertainty):
+    """
+    probability_value element by element over arrays of trust vectors
+    @return: array of probabilities
+    """
+    import numpy as np
+    trust, distrust, uncertainty = np.broadcast_arrays(np.asarray(trust, dtype=float),
+                                                       np.asarray(distrust, dtype=float),
+                                                       np.asarray(uncertainty, dtype=float))
+    distrusted = (trust < distrust) & ~(uncertainty > trust + distrust)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(distrusted, 1 - ((distrust - trust) / (trust + distrust)), 1.0)
+
 
 class Trust:
     def __init__(self, p_count=0, n_count=0, kinship=None):
@@ -14,33 +410,20 @@ class Trust:
         """
         This functions calculates certainty for various conditions
         if any of experience count is zero beta is 1
-        otherwise beta is calculated by using scipy.special module     
+        otherwise certainty is evaluated in closed form from the regularized incomplete beta
+        Values come from the registered certainty table when the counts are inside it, else from the memo cache
         @return: certainty value
         :rtype: float
         """
-        if self.p_count != 0 and self.n_count != 0:
-            beta = sc.beta(self.p_count, self.n_count)
-            print('Single integral computed by SciPy quad', self.p_count, self.n_count, beta)
-            if beta != 0:
-                integral_equation = lambda p_i: abs(
-                    ((p_i ** (self.p_count - 1)) * ((1 - p_i) ** (self.n_count - 1)) / beta) - 1) / 2
-            else:
-                integral_equation = lambda p_i: abs(
-                    ((p_i ** (self.p_count - 1)) * ((1 - p_i) ** (self.n_count - 1))) - 1) / 2
-
-        elif self.p_count == 0 and self.n_count != 0:
-            beta = 1
-            integral_equation = (lambda p_i: abs((1 * ((1 - p_i) ** (self.n_count - 1))) - 1))
-        elif self.n_count == 0 and self.p_count != 0:
-            beta = 1
-            integral_equation = (lambda p_i: abs(((p_i ** (self.p_count - 1)) * 1) - 1))
-        else:
-            print("Trust is not calculated as both experience count is zero")
+        if self.p_count == 0 and self.n_count == 0:
+            logger.warning("Trust is not calculated as both experience count is zero")
             exit(0)
-
-        a = 0
-        b = 1
-        result, error = spi.quad(integral_equation, a, b)
+        result = None
+        if certainty_table is not None:
+            result = certainty_table.lookup(self.p_count, self.n_count)
+        if result is None:
+            result = cached_certainty(self.p_count, self.n_count)
+        logger.debug('Certainty for experience counts %s %s %s', self.p_count, self.n_count, result)
 
         return result
 
@@ -58,5 +441,5 @@ class Trust:
             trust = round(self.p_count * c_b / (self.p_count + self.n_count), 2)
             distrust = round(self.n_count * c_b / (self.p_count + self.n_count), 2)
         uncertainty = round(1 - (trust + distrust), 2)
-        print("\n Updated trust vector is ", trust, distrust, uncertainty)
+        logger.info("Updated trust vector is %s %s %s", trust, distrust, uncertainty)
         return trust, distrust, uncertainty
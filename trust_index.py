@@ -0,0 +1,209 @@
+"""
+Index of the trust state of every user, for queries across the fleet without reading per user configurations
+The index is a sqlite table with one row per user, kept up to date by a persist listener of ConfigManger
+so every configuration write of a process that attached it updates the row of its user, and rebuilt from
+a storage when needed. trust_service.py and ingest.py attach it when started with --trust-index
+    python trust_index.py rebuild --source config
+    python trust_index.py query --where "distrust > trust" --order-by trust --limit 50
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import config_manager
+from storage import DEFAULT_CONFIG_DIR, open_storage
+from trust import probability_value
+from utils import *
+
+DEFAULT_INDEX_PATH = os.path.join(DEFAULT_CONFIG_DIR, "trust_index.db")
+# Indexed column to configuration key, probability is derived from the trust vector
+COLUMNS = {"trust": TRUST, "distrust": DISTRUST, "uncertainty": UNCERTAINTY, "kinship": KINSHIP,
+           "positive": POSITIVE_EXP_COUNT, "negative": NEGATIVE_EXP_COUNT, "missions": MISSIONS_WORKED_TOGETHER}
+INTEGER_COLUMNS = ("positive", "negative", "missions")
+OPERATORS = ("<=", ">=", "!=", "<", ">", "=")
+
+
+def index_row(user: str, config: dict):
+    """
+    @return: values of the index row of a user, in the order user, COLUMNS, probability
+    """
+    values = [config.get(key) for key in COLUMNS.values()]
+    trust, distrust, uncertainty = config.get(TRUST, 0), config.get(DISTRUST, 0), config.get(UNCERTAINTY, 0)
+    return [user] + values + [probability_value(trust, distrust, uncertainty)]
+
+
+class TrustIndex(object):
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        """
+        Opens or creates the index
+        @param path: sqlite database file of the index
+        """
+        import sqlite3
+        self.path = path
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS users (user TEXT PRIMARY KEY, %s, probability REAL)"
+                                % ", ".join(column + (" INTEGER" if column in INTEGER_COLUMNS else " REAL")
+                                            for column in COLUMNS))
+        for column in ("trust", "distrust", "probability"):
+            self.connection.execute("CREATE INDEX IF NOT EXISTS users_%s ON users (%s)" % (column, column))
+        self.listener = None
+        self.storage = None
+
+    def update(self, user: str, config: dict):
+        """
+        Writes the index row of a user from its configuration
+        """
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO users VALUES (%s)" % ", ".join("?" * (len(COLUMNS) + 2)),
+                                    index_row(user, config))
+
+    def remove(self, user: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM users WHERE user = ?", (user,))
+
+    def rebuild(self, source):
+        """
+        Replaces the whole index with the configurations of every user of a storage
+        @return: number of users indexed
+        """
+        rows = []
+        for user in source.list_users():
+            config = source.load_config(user)
+            if config is not None:
+                rows.append(index_row(user, config))
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute("DELETE FROM users")
+                self.connection.executemany("INSERT INTO users VALUES (%s)" % ", ".join("?" * (len(COLUMNS) + 2)),
+                                            rows)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        return len(rows)
+
+    def attach(self, user_storage=None):
+        """
+        Keeps the index up to date with every configuration written by this process
+        @param user_storage: only index configurations written to this storage, every storage if not given
+        """
+        self.detach()
+        self.storage = user_storage
+
+        def listener(user, written_storage, config):
+            if self.storage is None or written_storage is self.storage:
+                self.update(user, config)
+        self.listener = listener
+        config_manager.add_persist_listener(listener)
+
+    def detach(self):
+        if self.listener is not None:
+            config_manager.remove_persist_listener(self.listener)
+            self.listener = None
+
+    def query(self, conditions: list = (), order_by: str = None, descending: bool = False, limit: int = None):
+        """
+        Selects users of the index
+        @param conditions: list of (column, operator, value) all users must match, value is a number or
+            the name of another column, for example ("distrust", ">", "trust")
+        @param order_by: column the users are sorted by, user name if not given
+        @param descending: sort from the largest value
+        @param limit: maximum number of users returned
+        @return: list of dict, column name to value
+        """
+        names = ["user"] + list(COLUMNS) + ["probability"]
+        clauses, parameters = [], []
+        for column, operator, value in conditions:
+            if column not in names or operator not in OPERATORS:
+                raise Exception("Conditions use the columns %s and the operators %s" % (", ".join(names),
+                                                                                       " ".join(OPERATORS)))
+            if isinstance(value, str) and value in names:
+                clauses.append("%s %s %s" % (column, operator, value))
+            else:
+                clauses.append("%s %s ?" % (column, operator))
+                parameters.append(value)
+        order_by = order_by or "user"
+        if order_by not in names:
+            raise Exception("Users can be sorted by " + ", ".join(names))
+        sql = "SELECT %s FROM users" % ", ".join(names)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY %s %s, user" % (order_by, "DESC" if descending else "ASC")
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(int(limit))
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [dict(zip(names, row)) for row in rows]
+
+    def top(self, column: str = "trust", k: int = 50):
+        """
+        @return: the k users with the largest value of column
+        """
+        return self.query(order_by=column, descending=True, limit=k)
+
+    def distrusted(self):
+        """
+        @return: users whose distrust is larger than their trust, most distrusted first
+        """
+        return self.query([("distrust", ">", "trust")], order_by="probability")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        self.detach()
+        with self.lock:
+            self.connection.close()
+
+
+def parse_condition(text: str):
+    """
+    Reads a condition like "distrust > trust" or "trust>=0.5"
+    @return: (column, operator, value)
+    """
+    match = re.match(r"^\s*(\w+)\s*(%s)\s*(\S+)\s*$" % "|".join(re.escape(operator) for operator in OPERATORS),
+                     text)
+    if match is None:
+        raise argparse.ArgumentTypeError("Conditions look like column > value or column > column")
+    column, operator, value = match.groups()
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    return column, operator, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the trust state of every user")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="sqlite file of the index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="index every user of a storage again")
+    rebuild_parser.add_argument("--source", default=DEFAULT_CONFIG_DIR,
+                                help="config folder or sqlite .db file holding the configurations")
+    query_parser = subparsers.add_parser("query", help="print the users matching every condition")
+    query_parser.add_argument("--where", type=parse_condition, action="append", default=[])
+    query_parser.add_argument("--order-by", default=None)
+    query_parser.add_argument("--desc", action="store_true")
+    query_parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+    index = TrustIndex(args.index)
+    if args.command == "rebuild":
+        print("Indexed", index.rebuild(open_storage(args.source)), "users into", args.index)
+    else:
+        for row in index.query(args.where, args.order_by, args.desc, args.limit):
+            print(json.dumps(row))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
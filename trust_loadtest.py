@@ -0,0 +1,75 @@
+"""
+Load test client for trust_service.py
+Opens concurrent clients, each reporting subtasks for its own users, and prints
+p50 / p99 latency and requests per second
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from session_registry import SessionRegistry
+from storage import FileStorage
+from trust_service import TrustClient, TrustService
+
+
+async def run_client(client_id: int, args, latencies: list):
+    client = await TrustClient.connect(args.host, args.port, args.unix)
+    rng = random.Random(client_id)
+    users = ["loadtest%d_%d" % (client_id, i) for i in range(args.users_per_client)]
+    for _ in range(args.requests):
+        user = rng.choice(users)
+        if rng.random() < 0.5:
+            method, params = "fetch_probability_value", {}
+        else:
+            method, params = "calculate_trust", {
+                "role": rng.choice([1, 2, 3]),
+                "expected_time_for_task": 10,
+                "actual_response_list": [rng.uniform(0.5, 4) for _ in range(3)],
+                "sub_task_status": rng.choice([0, 1]),
+                "actual_time_for_task": rng.uniform(5, 15)}
+        start = time.perf_counter()
+        await client.call(user, method, **params)
+        latencies.append(time.perf_counter() - start)
+    await client.close()
+
+
+async def run(args):
+    service = None
+    if args.spawn:
+        # Serve from a throw away config folder so the load test never touches real users
+        storage = FileStorage(tempfile.mkdtemp(prefix="trust_loadtest"))
+        service = TrustService(SessionRegistry(args.clients * args.users_per_client, user_storage=storage))
+        await service.start(args.host, args.port, args.unix)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(i, args, latencies) for i in range(args.clients)])
+    elapsed = time.perf_counter() - start
+    if service is not None:
+        service.server.close()
+        await service.server.wait_closed()
+        service.close()
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print("requests", len(latencies))
+    print("p50 latency ms", round(quantiles[49] * 1000, 3))
+    print("p99 latency ms", round(quantiles[98] * 1000, 3))
+    print("requests per second", round(len(latencies) / elapsed, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the trust service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="unix socket path, used instead of host and port")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent connections")
+    parser.add_argument("--users-per-client", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="requests sent by each client")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a service in this process on a temporary config folder")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
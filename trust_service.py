@@ -0,0 +1,240 @@
+"""
+Asyncio service exposing InteractionAPI to robot controllers running in other processes
+The protocol is json lines over a unix socket or a localhost tcp port, one request per line:
+    {"id": 1, "user": "user19", "method": "calculate_trust", "params": {"role": 1, ...}}
+and one response per line:
+    {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+Requests of one user are applied in order, different users are served concurrently
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from human_interaction import validate_subtask
+from session_registry import SessionRegistry
+from storage import DEFAULT_CONFIG_DIR, open_storage, valid_user_name
+
+# Methods of InteractionAPI callable through the service
+METHODS = ("calculate_trust", "calculate_trust_batch", "fetch_probability_value", "update_kinship",
+           "get_trust_values", "update_exp_response_time", "update_experience_count", "update_attitude",
+           "update_initial_kinship", "update_predictor_threshold", "get_metrics")
+
+
+class TrustService(object):
+
+    def __init__(self, registry: SessionRegistry = None, workers: int = None):
+        """
+        @param registry: sessions the requests are applied to, a new registry if not given
+        @param workers: threads of the executor running trust calculations
+        """
+        self.registry = registry if registry is not None else SessionRegistry()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Lock of every user with a live session or a request in flight, and the number of those requests
+        self.user_locks = {}
+        self.pending = {}
+        self.loop = None
+        self.server = None
+        self.registry.add_evict_listener(self.evicted)
+
+    @asynccontextmanager
+    async def user_lock(self, user: str):
+        """
+        Holds the lock of the user, requests of one user are applied one at a time in arrival order
+        """
+        lock = self.user_locks.get(user)
+        if lock is None:
+            lock = self.user_locks[user] = asyncio.Lock()
+        self.pending[user] = self.pending.get(user, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.pending[user] -= 1
+            if not self.pending[user]:
+                del self.pending[user]
+                self.drop_lock(user)
+
+    def drop_lock(self, user: str):
+        """
+        Forgets the lock of a user whose session was dropped and has no request in flight
+        """
+        if user not in self.pending and user not in self.registry:
+            self.user_locks.pop(user, None)
+
+    def evicted(self, user: str):
+        # Called in an executor thread, the locks are only touched in the event loop
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.drop_lock, user)
+
+    @staticmethod
+    def validate(method: str, params: dict):
+        """
+        Checks the subtasks of a request before it reaches the session
+        @raise ValueError: when the parameters cannot be used
+        """
+        if not isinstance(params, dict):
+            raise ValueError("params must be a json object")
+        if method == "calculate_trust":
+            validate_subtask(params)
+        elif method == "calculate_trust_batch":
+            if not isinstance(params.get("records"), list):
+                raise ValueError("records must be a list of subtasks")
+            for record in params["records"]:
+                validate_subtask(record)
+
+    def call(self, user: str, method: str, params: dict):
+        """
+        Runs one InteractionAPI method, called in the executor
+        """
+        try:
+            result = getattr(self.registry.get(user), method)(**params)
+        except SystemExit:
+            # Predictors and Trust exit on values they cannot use, one request must not stop the service
+            raise Exception("%s stopped on the parameters of %s" % (method, user))
+        return list(result) if isinstance(result, tuple) else result
+
+    async def handle_request(self, request: dict):
+        """
+        @param request: decoded request line
+        @return: response dict
+        """
+        response = {"id": request.get("id")}
+        user, method = request.get("user"), request.get("method")
+        if not valid_user_name(user) or method not in METHODS:
+            response["error"] = ("Request needs a user made of letters, digits, _ . and - and one of the methods "
+                                 + ", ".join(METHODS))
+            return response
+        params = request.get("params") or {}
+        loop = asyncio.get_running_loop()
+        try:
+            self.validate(method, params)
+            async with self.user_lock(user):
+                response["result"] = await loop.run_in_executor(self.executor, self.call, user, method, params)
+        except Exception as e:
+            response["error"] = "%s: %s" % (type(e).__name__, e)
+        return response
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves the requests of one client, responses are written in request order
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {"id": None, "error": "Request is not valid json"}
+                else:
+                    response = await self.handle_request(request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, unix_path: str = None):
+        """
+        Starts listening on the unix socket if a path is given, otherwise on host and port
+        """
+        self.loop = asyncio.get_running_loop()
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8765, unix_path: str = None):
+        await self.start(host, port, unix_path)
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the executor and flushes every session
+        """
+        self.executor.shutdown(wait=True)
+        self.registry.clear()
+
+
+class TrustClient(object):
+    """
+    Client of the trust service, one request in flight per client
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8765, unix_path: str = None):
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def call(self, user: str, method: str, **params):
+        """
+        Sends one request and waits for its response
+        @return: result of the method
+        """
+        self.next_id += 1
+        request = {"id": self.next_id, "user": user, "method": method, "params": params}
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        if "error" in response:
+            raise Exception(response["error"])
+        return response["result"]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve InteractionAPI over a local socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="unix socket path, used instead of host and port")
+    parser.add_argument("--capacity", type=int, default=128, help="live sessions kept in memory")
+    parser.add_argument("--workers", type=int, default=None, help="threads running trust calculations")
+    parser.add_argument("--storage", default=DEFAULT_CONFIG_DIR,
+                        help="config folder or sqlite .db file receiving the updates")
+    parser.add_argument("--trust-index", help="sqlite file of a trust index kept up to date with every update")
+    parser.add_argument("--trust-table", help="shared memory trust table receiving every update, created if needed")
+    args = parser.parse_args()
+    user_storage = open_storage(args.storage)
+    index, table = None, None
+    if args.trust_index:
+        from trust_index import TrustIndex
+        index = TrustIndex(args.trust_index)
+        index.attach(user_storage)
+    if args.trust_table:
+        from shared_trust import open_table
+        table = open_table(args.trust_table)
+        table.attach(user_storage)
+    service = TrustService(SessionRegistry(args.capacity, user_storage=user_storage), args.workers)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if index is not None:
+            index.close()
+        if table is not None:
+            table.close()
+
+
+if __name__ == "__main__":
+    main()
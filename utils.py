@@ -17,4 +17,6 @@ MISSIONS_WORKED_TOGETHER = 'missions_worked_together'
 GOALS_ACHIEVED = 'goals achieved'
 USER = 'user'
 TRUST_THRESHOLD = 'trust threshold'
+# Running statistics of an unfinished mission, kept only while no session of the user is live
+MISSION_IN_PROGRESS = 'mission in progress'
 